@@ -1,94 +1,300 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from app.api.schemas import QueryRequest, QueryResponse, LogEntry, FeedbackRequest
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from app.api.schemas import QueryRequest, QueryResponse, LogEntry, FeedbackRequest, BatchQueryRequest, BatchQueryResponse
 from app.services.safety import get_safety_guard
 from app.services.retrieval import get_retrieval_service
-from app.services.generation import get_generation_service
+from app.services.generation import get_generation_service, GenerationInterruptedError
+from app.services.answering import get_batch_answer_service, extract_sources, cache_answer, new_context, log_answer
+from app.services.embeddings import get_embedding_batcher, get_embedding_service
+from app.services.cache import get_answer_cache
+from app.services.reranker import get_reranker
+from app.services.warmup import get_startup_report
+from app.core.concurrency import stage_stats, StageOverloadedError
+from app.core import metrics
+from app.core.metrics import span, start_request_timings
+from app.core.config import get_settings
 from app.db.mongo import db
-from typing import List
+from typing import Any, Dict, List
 import json
 
+settings = get_settings()
 router = APIRouter()
 
+async def _prepare(query: str) -> Dict[str, Any]:
+    """
+    Everything that runs before generation: keyword safety, answer cache lookup
+    (exact text first, then embedding similarity), semantic safety on the query
+    embedding, and retrieval.
+    """
+    # 1. Safety Check (keywords)
+    safety_guard = get_safety_guard()
+    with span("safety_keywords"):
+        is_unsafe, safety_flag, safety_msg = safety_guard.check_query(query)
+    ctx = new_context(is_unsafe, safety_flag, safety_msg)
+    if is_unsafe:
+        return ctx
+
+    retrieval_service = get_retrieval_service()
+    answer_cache = get_answer_cache() if settings.ANSWER_CACHE_ENABLED else None
+
+    # 2. Exact cache hit skips the model entirely
+    with span("answer_cache"):
+        cached = answer_cache.get_exact(query) if answer_cache else None
+    if cached is None:
+        try:
+            with span("embedding"):
+                query_embedding = await retrieval_service.aembed_query(query)
+        except StageOverloadedError:
+            # Embedding model saturated: answer from the BM25 index instead of rejecting.
+            # Without an embedding the semantic safety tier cannot run, so when it is enabled
+            # the query is rejected (503) rather than answered on the keyword check alone.
+            if not settings.LEXICAL_FALLBACK_ENABLED or settings.SAFETY_SEMANTIC_ENABLED:
+                raise
+            fallback = await retrieval_service.alexical_search(query)
+            if fallback is None:
+                raise
+            ctx["retrieved_chunks"] = [res["content"] for res in fallback]
+            ctx["sources"] = extract_sources(fallback)
+            return ctx
+        ctx["query_embedding"] = query_embedding
+
+        # 3. Safety Check (semantic, reusing the retrieval embedding)
+        with span("safety_semantic"):
+            is_unsafe, safety_flag, safety_msg = await safety_guard.acheck_embedding(query_embedding)
+        if is_unsafe:
+            ctx.update(is_unsafe=is_unsafe, safety_flag=safety_flag, safety_msg=safety_msg)
+            return ctx
+
+        if answer_cache:
+            with span("answer_cache"):
+                cached = answer_cache.get_similar(query_embedding)
+
+    if cached is not None:
+        ctx.update(cached=cached, retrieved_chunks=cached["retrieved_context"], sources=cached["sources"])
+        return ctx
+
+    # 4. Retrieval
+    with span("retrieval"):
+        retrieval_results = await retrieval_service.aretrieve(query, ctx["query_embedding"])
+    ctx["retrieved_chunks"] = [res["content"] for res in retrieval_results]
+    ctx["sources"] = extract_sources(retrieval_results)
+    return ctx
+
 @router.post("/ask", response_model=QueryResponse)
-async def ask_question(request: QueryRequest, background_tasks: BackgroundTasks):
+async def ask_question(request: QueryRequest):
     query = request.query.strip()
     if not query:
         raise HTTPException(status_code=400, detail="Query cannot be empty")
 
-    # 1. Safety Check
-    safety_guard = get_safety_guard()
-    is_unsafe, safety_flag, safety_msg = safety_guard.check_query(query)
-
-    retrieved_chunks = []
-    sources = []
-    answer = ""
-
-    if safety_flag == "BLOCKED":
-        answer = safety_msg
-    elif is_unsafe:
-         # For UNSAFE but not BLOCKED, we still want to give the safety message 
-         # but potentially retrieval logic is skipped or limited. 
-         # The requirement says: Return a response that contains a gentle safety message, modification, etc.
-         answer = safety_msg
+    timings = start_request_timings()
+    ctx = await _prepare(query)
+
+    if ctx["is_unsafe"]:
+        # BLOCKED, or UNSAFE: return the gentle safety message instead of an answer
+        answer = ctx["safety_msg"]
+    elif ctx["cached"] is not None:
+        answer = ctx["cached"]["answer"]
     else:
-        # 2. Retrieval
-        retrieval_service = get_retrieval_service()
-        retrieval_results = retrieval_service.retrieve(query)
-        
-        # Extract content for generation and sources for display
-        retrieved_chunks = [res["content"] for res in retrieval_results]
-        
-        # Parse metadata for sources
-        for res in retrieval_results:
-            meta = res.get("metadata", {})
-            # Try to get title from original_data JSON string if possible
-            title = meta.get("source", "Unknown Source")
-            try:
-                if "original_data" in meta:
-                    orig = json.loads(meta["original_data"])
-                    if "title" in orig:
-                        title = orig["title"]
-            except:
-                pass
-            sources.append(title)
-        
-        # 3. Generation
+        # 5. Generation
         generation_service = get_generation_service()
-        raw_answer = generation_service.generate_response(query, retrieved_chunks, safety_flag)
-        
-        # 4. Soften Response if needed (SafetyGuard handles most logic now, but keep as fallback)
-        answer = raw_answer
-
-    # 5. Logging (Background Task to not block response)
-    background_tasks.add_task(
-        db.log_interaction,
-        query=query,
-        response=answer,
-        retrieved_chunks=retrieved_chunks,
-        safety_flag=safety_flag,
-        is_unsafe=is_unsafe
-    )
+        with span("generation"):
+            answer = await generation_service.agenerate_response(query, ctx["retrieved_chunks"], ctx["safety_flag"])
+        cache_answer(query, ctx, answer)
+
+    # 6. Logging (buffered, written to Mongo in batches)
+    log_answer(query, ctx, answer, timings)
 
     return QueryResponse(
         answer=answer,
-        safety_flag=safety_flag,
-        is_unsafe=is_unsafe,
-        sources=sources,
-        retrieved_context=retrieved_chunks
+        safety_flag=ctx["safety_flag"],
+        is_unsafe=ctx["is_unsafe"],
+        sources=ctx["sources"],
+        retrieved_context=ctx["retrieved_chunks"]
     )
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest):
+    """
+    Server-Sent Events variant of /ask.
+    Emits a `sources` event once retrieval is done, `token` events as the answer is generated,
+    then a `done` event with the safety flag (or an `error` event).
+    """
+    query = request.query.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    # Retrieval happens before the response starts, so overload still maps to a 503
+    timings = start_request_timings()
+    ctx = await _prepare(query)
+
+    async def event_stream():
+        answer_parts = []
+        try:
+            yield _sse("sources", {"sources": ctx["sources"], "retrieved_context": ctx["retrieved_chunks"]})
+
+            if ctx["is_unsafe"]:
+                answer_parts.append(ctx["safety_msg"])
+                yield _sse("token", {"text": ctx["safety_msg"]})
+            elif ctx["cached"] is not None:
+                answer_parts.append(ctx["cached"]["answer"])
+                yield _sse("token", {"text": ctx["cached"]["answer"]})
+            else:
+                generation_service = get_generation_service()
+                # Includes time the client takes to read the stream
+                with span("generation"):
+                    async for token in generation_service.astream_response(query, ctx["retrieved_chunks"], ctx["safety_flag"]):
+                        answer_parts.append(token)
+                        yield _sse("token", {"text": token})
+                cache_answer(query, ctx, "".join(answer_parts))
+
+            yield _sse("done", {"safety_flag": ctx["safety_flag"], "is_unsafe": ctx["is_unsafe"]})
+        except StageOverloadedError as e:
+            yield _sse("error", {"detail": f"Server is busy ({e.stage}). Please retry shortly."})
+        except GenerationInterruptedError as e:
+            # The partial answer is logged below but never cached
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            # Log the full answer even if the client disconnected mid-stream
+            log_answer(query, ctx, "".join(answer_parts), timings)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/ask/batch", response_model=BatchQueryResponse)
+async def ask_batch(request: BatchQueryRequest):
+    """
+    Answers many queries in one request, for evaluation runs and bulk jobs.
+    Results come back in input order, or with stream=true as NDJSON lines
+    ({"index": ..., "answer": ..., ...}) in completion order.
+    """
+    queries = [query.strip() for query in request.queries]
+    if not queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if len(queries) > settings.BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_QUERIES} queries per batch")
+    empty = [i for i, query in enumerate(queries) if not query]
+    if empty:
+        raise HTTPException(status_code=400, detail=f"Query cannot be empty (index {empty[0]})")
+
+    # Embedding and retrieval happen before the response starts, so overload still maps to a 503
+    batch_service = get_batch_answer_service()
+    ctxs = await batch_service.prepare(queries)
+
+    if request.stream:
+        async def ndjson_stream():
+            async for i, result in batch_service.iter_answers(queries, ctxs):
+                yield json.dumps({"index": i, **result}) + "\n"
+
+        return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+    results = await batch_service.answer(queries, ctxs)
+    return BatchQueryResponse(results=[{"index": i, **result} for i, result in enumerate(results)])
+
 @router.post("/feedback")
 async def submit_feedback(request: FeedbackRequest):
-    if db.db is None:
-        return {"status": "error", "message": "Database not connected"}
-    
-    await db.db.feedback.insert_one(request.dict())
+    if not await db.log_feedback(request.dict()):
+        return {"status": "error", "message": "Feedback could not be stored"}
     return {"status": "success", "message": "Feedback received"}
 
 @router.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "Yoga RAG API"}
 
+@router.get("/health/live")
+async def liveness_check():
+    # The event loop is responsive; says nothing about models
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+async def readiness_check():
+    """
+    200 once warm-up has loaded the models, 503 before that (or if warm-up failed),
+    so load balancers only route traffic to warm processes.
+    """
+    report = get_startup_report()
+    if not report.ready:
+        status = "failed" if report.error else "warming_up"
+        return JSONResponse(status_code=503, content={"status": status, **report.as_dict()})
+    return {"status": "ready", **report.as_dict()}
+
+@router.get("/stats")
+async def get_stats():
+    report = get_startup_report()
+    if not report.ready:
+        # Building the services here would load models on the event loop while warm-up is loading them
+        return {"stages": stage_stats(), "interaction_log": db.buffer.stats(), "startup": report.as_dict()}
+
+    embedding_cache = getattr(get_embedding_service(), "cache", None)
+    reranker = get_reranker()
+    return {
+        "stages": stage_stats(),
+        "embedding_batcher": get_embedding_batcher().stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "answer_cache": get_answer_cache().stats(),
+        "reranker": reranker.stats() if reranker else None,
+        "generation": get_generation_service().stats(),
+        "interaction_log": db.buffer.stats(),
+        "startup": report.as_dict()
+    }
+
+STAGE_ACTIVE = metrics.registry.gauge("rag_stage_active", "Requests holding a stage slot.", ("stage",))
+STAGE_WAITING = metrics.registry.gauge("rag_stage_waiting", "Requests queued for a stage slot.", ("stage",))
+STAGE_REJECTED = metrics.registry.counter("rag_stage_rejected_total", "Requests rejected because a stage queue was full.", ("stage",))
+CACHE_LOOKUPS = metrics.registry.counter("rag_cache_lookups_total", "Embedding and answer cache lookups by result.", ("cache", "result"))
+EMBEDDING_BATCHES = metrics.registry.counter("rag_embedding_batches_total", "Micro-batches sent to the embedding model.")
+EMBEDDING_BATCH_QUEUED = metrics.registry.gauge("rag_embedding_batcher_queued", "Texts waiting in the embedding micro-batcher.")
+LOG_QUEUED = metrics.registry.gauge("rag_interaction_log_queued", "Interaction log entries waiting to be written.")
+LOG_ENTRIES = metrics.registry.counter("rag_interaction_log_entries_total", "Interaction log entries by outcome.", ("outcome",))
+READY = metrics.registry.gauge("rag_ready", "1 once warm-up has finished (summed across workers).")
+
+def _collect_service_metrics():
+    """
+    Mirrors the counters and gauges services already keep (see /stats) into the metrics registry.
+    """
+    for name, stage in stage_stats().items():
+        STAGE_ACTIVE.set(stage["active"], stage=name)
+        STAGE_WAITING.set(stage["waiting"], stage=name)
+        STAGE_REJECTED.set(stage["rejected"], stage=name)
+
+    log_stats = db.buffer.stats()
+    LOG_QUEUED.set(log_stats["queued"])
+    for outcome in ("written", "spilled", "dropped"):
+        LOG_ENTRIES.set(log_stats[outcome], outcome=outcome)
+
+    ready = get_startup_report().ready
+    READY.set(1 if ready else 0)
+    if not ready:
+        return # Scrapes must not load the embedding model on the event loop; warm-up does that
+
+    embedding_cache = getattr(get_embedding_service(), "cache", None)
+    if embedding_cache is not None:
+        cache_stats = embedding_cache.stats()
+        CACHE_LOOKUPS.set(cache_stats["hits"], cache="embedding", result="hit")
+        CACHE_LOOKUPS.set(cache_stats["misses"], cache="embedding", result="miss")
+    answer_stats = get_answer_cache().stats()
+    CACHE_LOOKUPS.set(answer_stats["exact_hits"], cache="answer", result="exact_hit")
+    CACHE_LOOKUPS.set(answer_stats["semantic_hits"], cache="answer", result="semantic_hit")
+    CACHE_LOOKUPS.set(answer_stats["misses"], cache="answer", result="miss")
+
+    batcher_stats = get_embedding_batcher().stats()
+    EMBEDDING_BATCHES.set(batcher_stats["batches"])
+    EMBEDDING_BATCH_QUEUED.set(batcher_stats["queued"])
+
+
+metrics.registry.register_collector(_collect_service_metrics)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(metrics.collect()), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @router.get("/logs", response_model=List[LogEntry])
 async def get_logs(limit: int = 10):
     if db.db is None:
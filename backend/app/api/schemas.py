@@ -11,6 +11,16 @@ class QueryResponse(BaseModel):
     is_unsafe: bool
     sources: List[str]
     retrieved_context: Optional[List[str]] = []
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    stream: bool = False # Stream results as NDJSON in completion order
+
+class BatchQueryItem(QueryResponse):
+    index: int
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryItem]
     
 class LogEntry(BaseModel):
     query: str
@@ -18,6 +28,7 @@ class LogEntry(BaseModel):
     safety_flag: str
     is_unsafe: bool
     timestamp: datetime
+    timings_ms: Optional[Dict[str, float]] = None
 
 class FeedbackRequest(BaseModel):
     query: str
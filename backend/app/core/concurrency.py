@@ -0,0 +1,127 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+from app.core.config import get_settings
+
+settings = get_settings()
+
+
+class StageOverloadedError(Exception):
+    """
+    Raised when a pipeline stage has no free slot and its wait queue is full.
+    """
+    def __init__(self, stage: str):
+        super().__init__(f"Stage '{stage}' is overloaded")
+        self.stage = stage
+
+
+class StageLimiter:
+    """
+    Bounds how many requests may run a pipeline stage at once and how many may wait for it.
+    Callers beyond the wait queue are rejected immediately instead of piling up.
+    """
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise StageOverloadedError(self.name)
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def try_slot(self):
+        """
+        Like slot(), but never waits: yields True while holding a slot, or False (holding nothing)
+        when none is free right now. For optional extra work, such as a hedged request.
+        """
+        if self._semaphore.locked():
+            yield False
+            return
+        await self._semaphore.acquire() # Free slot and no waiters: returns without suspending
+        self.active += 1
+        try:
+            yield True
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def saturated(self) -> bool:
+        """
+        True when every slot is taken, i.e. a new caller would have to wait.
+        """
+        return self._semaphore.locked()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs a blocking callable on the shared inference executor while holding a stage slot.
+        """
+        async with self.slot():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+# Shared executor for embedding, vector search and local generation
+_executor: Optional[ThreadPoolExecutor] = None
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.INFERENCE_THREADS,
+            thread_name_prefix="inference"
+        )
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+_stages: Dict[str, StageLimiter] = {}
+
+def get_stage(name: str) -> StageLimiter:
+    if name not in _stages:
+        limits = {
+            "embedding": settings.EMBEDDING_CONCURRENCY,
+            "retrieval": settings.RETRIEVAL_CONCURRENCY,
+            "generation": settings.GENERATION_CONCURRENCY,
+            "rerank": settings.RERANK_CONCURRENCY,
+        }
+        _stages[name] = StageLimiter(name, limits.get(name, 1), settings.STAGE_QUEUE_LIMIT)
+    return _stages[name]
+
+def stage_stats() -> Dict[str, Dict[str, int]]:
+    return {name: stage.stats() for name, stage in _stages.items()}
@@ -9,21 +9,139 @@ class Settings(BaseSettings):
     # Database
     MONGODB_URL: str = "mongodb://localhost:27017"
     MONGODB_DB_NAME: str = "yoga_rag_db"
+    MONGODB_TIMEOUT_MS: int = 5000
+
+    # Interaction Logging (write-behind buffer)
+    LOG_BUFFER_MAX_SIZE: int = 10000
+    LOG_FLUSH_BATCH_SIZE: int = 100
+    LOG_FLUSH_INTERVAL_MS: float = 1000
+    LOG_SPILL_PATH: str = "data/interaction_spill.jsonl" # Empty string drops entries instead
+    LOG_REQUEST_TIMINGS: bool = False # Attach per-stage timings_ms to each logged interaction
     
     # Vector Store
     CHROMA_PERSIST_DIRECTORY: str = "data/chroma_db"
+    VECTOR_BACKEND: str = "chroma" # "chroma" or "numpy" (memory-mapped matrix snapshotted from Chroma after ingest)
+    VECTOR_INDEX_DIRECTORY: str = "data/vector_index"
+    VECTOR_INDEX_DTYPE: str = "float32" # "float32", "float16" or "int8" (one scale per row)
+    VECTOR_IVF_NLIST: int = 0 # k-means lists for large corpora (about sqrt(N)); 0 always searches exhaustively
+    VECTOR_IVF_NPROBE: int = 8 # Lists scanned per unfiltered query in IVF mode
     
     # Embeddings
     EMBEDDING_MODEL_NAME: str = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBEDDING_BATCHING_ENABLED: bool = True
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_DIRECTORY: str = "data/embedding_cache" # Keyed by (model name, text hash); document chunks only, never queries
+    EMBEDDING_CACHE_MAX_ROWS: int = 1_000_000
+    EMBEDDING_BACKEND: str = "torch" # "torch" (sentence-transformers), "onnx" (ONNX Runtime, no torch import) or "sidecar"
+    EMBEDDING_ONNX_DIRECTORY: str = "data/onnx_embedding" # Written by scripts/export_onnx.py
+    EMBEDDING_ONNX_QUANTIZED: bool = True # Dynamic int8 weights; check drift with scripts/check_embedding_parity.py
+    EMBEDDING_ONNX_THREADS: int = 0 # Intra-op threads per inference call; 0 lets ONNX Runtime decide
     
     # LLM
     OPENAI_API_KEY: str = ""
     LLM_MODEL: str = "gpt-3.5-turbo" # or gpt-4
+    LLM_TIMEOUT_SECONDS: float = 30.0
+    OPENAI_BASE_URL: str = "https://api.openai.com/v1"
+    LOCAL_LLM_BASE_URL: str = "" # OpenAI-compatible local server (llama.cpp, vLLM), e.g. http://localhost:8080/v1
+    LOCAL_LLM_MODEL: str = "local"
+    LOCAL_MODEL_NAME: str = "google/flan-t5-base" # In-process transformers model
+
+    # Generation Backends
+    GENERATION_BACKENDS: str = "openai,local_server,transformers" # Preference order; unconfigured backends are skipped
+    LLM_MAX_RETRIES: int = 2
+    LLM_RETRY_BASE_DELAY_MS: float = 250.0 # Full-jitter exponential backoff
+    LLM_HEDGE_AFTER_MS: float = 0.0 # Race a second remote request once the first is this slow; 0 disables
+    LLM_MAX_CONNECTIONS: int = 20 # Pooled keep-alive connections per HTTP backend
+    GENERATION_FALLBACK_P95_MS: float = 10000.0 # Route past a remote backend whose recent p95 exceeds this; 0 disables
+    GENERATION_LATENCY_WINDOW_SECONDS: float = 120.0
+
+    # Context Compression (sentence dedupe + token budget before generation)
+    CONTEXT_COMPRESSION_ENABLED: bool = True
+    CONTEXT_TOKEN_BUDGET_OPENAI: int = 1200
+    CONTEXT_TOKEN_BUDGET_LOCAL: int = 400 # FLAN-T5 reads 512 tokens, minus instructions and question
+    CONTEXT_TOKEN_BUDGET_LOCAL_SERVER: int = 1200
     
     # RAG Settings
-    CHUNK_SIZE: int = 500
+    CHUNK_STRATEGY: str = "sentence" # "sentence" (token-budgeted) or "character"
+    CHUNK_TOKEN_BUDGET: int = 200 # all-MiniLM-L6-v2 truncates at 256 tokens
+    CHUNK_TOKEN_OVERLAP: int = 32
+    CHUNK_SIZE: int = 500 # Characters, for the "character" strategy
     CHUNK_OVERLAP: int = 50
     TOP_K_RETRIEVAL: int = 3
+
+    # Hybrid Retrieval (BM25 + dense, fused with reciprocal rank fusion)
+    RETRIEVAL_MODE: str = "hybrid" # "dense", "lexical" or "hybrid"
+    HYBRID_CANDIDATES: int = 10 # Per-retriever candidates before fusion
+    HYBRID_DENSE_WEIGHT: float = 1.0
+    HYBRID_LEXICAL_WEIGHT: float = 1.0
+    HYBRID_RRF_K: int = 60
+    LEXICAL_FALLBACK_ENABLED: bool = True # Serve BM25 results when the embedding stage is overloaded (only with SAFETY_SEMANTIC_ENABLED off, which needs the embedding)
+
+    # Re-ranking (cross-encoder over over-fetched candidates)
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL_NAME: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 20 # First-stage candidates scored per query
+    RERANK_MAX_LENGTH: int = 256 # Query + chunk tokens per pair
+    RERANK_BATCH_SIZE: int = 32 # Pairs per forward pass, so large /ask/batch calls do not run thousands at once
+    RERANK_CACHE_SIZE: int = 10000 # (query, chunk) pair scores kept in the LRU cache
+    RERANK_LATENCY_BUDGET_MS: float = 150.0 # Skip re-ranking when the estimated scoring time exceeds this; 0 disables
+    RERANK_CONCURRENCY: int = 1 # Re-ranking is skipped, not queued, while all slots are busy
+
+    # Ingestion
+    INGEST_WORKERS: int = 1 # Parser processes; 1 parses in-process
+    INGEST_EMBED_BATCH_SIZE: int = 64
+    INGEST_WRITE_BATCH_SIZE: int = 512
+    INGEST_QUEUE_SIZE: int = 8 # Batches buffered between pipeline stages
+    INGEST_STORE_ORIGINAL_DATA: bool = False # Keep each JSON record serialized in chunk metadata (display fields are always flattened)
+    INGEST_JSON_MAX_RECORD_CHARS: int = 64_000_000 # Largest single JSON record the streaming parser will buffer
+
+    # PDF Extraction
+    PDF_PAGES_PER_DOCUMENT: int = 1 # Pages merged into each document (page-level citations at 1)
+    PDF_WORKERS: int = 0 # Extraction processes for large PDFs; 0 uses every CPU, 1 disables the pool
+    PDF_PARALLEL_MIN_PAGES: int = 40 # Smaller PDFs are extracted in-process
+    PDF_MAX_PAGES_IN_FLIGHT: int = 64 # Memory ceiling: extracted pages buffered ahead of the consumer
+
+    # Answer Cache
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.92 # Cosine similarity for a semantic hit
+
+    # Batch Answering (/ask/batch)
+    BATCH_MAX_QUERIES: int = 500
+    BATCH_GENERATION_CONCURRENCY: int = 4 # Generations in flight per batch, still bounded by the generation stage
+    BATCH_OVERLOAD_RETRIES: int = 5 # Backoff retries when the generation stage is saturated
+
+    # Safety
+    SAFETY_TERMS_FILE: str = "" # Optional JSON {"critical": [...], "pregnancy": [...], "medical": [...]}, hot-reloaded
+    SAFETY_SEMANTIC_ENABLED: bool = True
+    SAFETY_SEMANTIC_THRESHOLD: float = 0.6 # Cosine similarity to a category prototype
+
+    # Concurrency / Backpressure
+    INFERENCE_THREADS: int = 4
+    EMBEDDING_CONCURRENCY: int = 2
+    RETRIEVAL_CONCURRENCY: int = 4
+    GENERATION_CONCURRENCY: int = 2
+    STAGE_QUEUE_LIMIT: int = 32 # Requests allowed to wait per stage before returning 503
+
+    # Startup
+    WARMUP_ENABLED: bool = True # Load models and run a dummy inference before reporting ready
+    WARMUP_BLOCKING: bool = False # Finish warm-up before accepting connections (otherwise /health/ready gates traffic)
+
+    # Multi-worker Serving (gunicorn -c gunicorn.conf.py app.main:app)
+    SERVER_WORKERS: int = 1
+    SERVER_PRELOAD_MODELS: bool = True # Load weights in the master before fork so workers share them copy-on-write
+    WORKER_THREADS: int = 0 # Torch/BLAS threads per worker; 0 divides the cores between workers
+    INFERENCE_SOCKET_PATH: str = "/tmp/yoga-inference.sock" # Sidecar for EMBEDDING_BACKEND=sidecar and the "sidecar" generation backend
+    SIDECAR_EMBEDDING_BACKEND: str = "torch" # Backend the sidecar itself embeds with: "torch" or "onnx"
+
+    # Metrics (GET /metrics, Prometheus text format)
+    METRICS_ENABLED: bool = True
+    METRICS_MULTIPROCESS_DIRECTORY: str = "" # Shared by gunicorn workers so /metrics covers all of them; empty reports one process
+    METRICS_SNAPSHOT_INTERVAL_SECONDS: float = 5.0
     
     class Config:
         env_file = ".env"
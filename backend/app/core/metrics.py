@@ -0,0 +1,336 @@
+import asyncio
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Seconds; spans range from sub-millisecond cache lookups to multi-second generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock() # Observed from executor threads too
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _sample(self, value: Any) -> Any:
+        return value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = [[list(key), self._sample(value)] for key, value in self._values.items()]
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames), "samples": samples}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels):
+        """
+        Mirrors a cumulative count kept elsewhere (e.g. a service's stats()).
+        """
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, the last one for +Inf, and the sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            state[0][index] += 1
+            state[1] += value
+
+    def _sample(self, value: Any) -> Any:
+        return {"counts": list(value[0]), "sum": value[1]}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**super().snapshot(), "buckets": list(self.buckets)}
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics rendered in the Prometheus text format.
+    Collectors run before every snapshot, to mirror counters and gauges that services already keep in stats().
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collect: Callable[[], None]):
+        self._collectors.append(collect)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collect.__name__} failed: {e}")
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+
+def merge_snapshots(snapshots: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Sums samples with the same name and labels across processes (histograms bucket by bucket).
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    values: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = {key: value for key, value in metric.items() if key != "samples"}
+                values[name] = {}
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                current = values[name].get(key)
+                if current is None:
+                    values[name][key] = {"counts": list(value["counts"]), "sum": value["sum"]} if isinstance(value, dict) else value
+                elif isinstance(value, dict):
+                    current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                    current["sum"] += value["sum"]
+                else:
+                    values[name][key] = current + value
+    for name, metric in merged.items():
+        metric["samples"] = [[list(key), value] for key, value in values[name].items()]
+    return merged
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [(name, value) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def render(snapshot: Dict[str, Dict[str, Any]]) -> str:
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for labels, value in metric["samples"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [math.inf], value["counts"]):
+                cumulative += count
+                le = "+Inf" if math.isinf(bound) else repr(float(bound))
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# Multi-process serving: every worker writes its snapshot to METRICS_MULTIPROCESS_DIRECTORY and
+# /metrics (answered by whichever worker) merges them. Counters of exited workers keep counting
+# towards the totals so they never go backwards; their gauges are dropped once the file is stale.
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{pid}.json")
+
+def write_snapshot(directory: str = settings.METRICS_MULTIPROCESS_DIRECTORY):
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"written_at": time.time(), "metrics": registry.snapshot()}, f)
+    os.replace(tmp_path, path)
+
+def clear_snapshots(directory: str = settings.METRICS_MULTIPROCESS_DIRECTORY):
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+def collect(directory: str = settings.METRICS_MULTIPROCESS_DIRECTORY,
+            interval: float = settings.METRICS_SNAPSHOT_INTERVAL_SECONDS) -> Dict[str, Dict[str, Any]]:
+    """
+    This process's metrics, merged with the other workers' latest snapshots when a directory is configured.
+    """
+    snapshots = [registry.snapshot()]
+    if not directory:
+        return snapshots[0]
+    own_path = _snapshot_path(directory, os.getpid())
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        if path == own_path:
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue # Being replaced or removed right now
+        metrics = data["metrics"]
+        if time.time() - data["written_at"] > 3 * interval:
+            metrics = {name: metric for name, metric in metrics.items() if metric["type"] != "gauge"}
+        snapshots.append(metrics)
+    return merge_snapshots(snapshots)
+
+async def run_snapshot_writer(directory: str = settings.METRICS_MULTIPROCESS_DIRECTORY,
+                              interval: float = settings.METRICS_SNAPSHOT_INTERVAL_SECONDS):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                write_snapshot(directory)
+            except OSError as e:
+                logger.warning(f"Failed to write metrics snapshot: {e}")
+    finally:
+        # Final counts on shutdown, so they survive the worker
+        write_snapshot(directory)
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP requests by route template and status.", ("method", "path", "status"))
+HTTP_DURATION = registry.histogram("http_request_duration_seconds", "HTTP request latency, including streamed bodies.", ("method", "path"))
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "HTTP requests currently being served.")
+STAGE_DURATION = registry.histogram("rag_stage_duration_seconds", "Time spent in each pipeline stage, including waits for a stage slot.", ("stage",))
+STAGE_ERRORS = registry.counter("rag_stage_errors_total", "Exceptions raised out of a pipeline stage.", ("stage", "error"))
+SAFETY_FLAGS = registry.counter("rag_safety_flags_total", "Answered queries by safety verdict.", ("flag",))
+GENERATION_ERRORS = registry.counter("rag_generation_errors_total", "Answers replaced by an error message because no backend succeeded.", ("reason",))
+GENERATION_BACKEND_REQUESTS = registry.counter("rag_generation_backend_requests_total", "Generation attempts per backend.", ("backend", "outcome"))
+GENERATION_BACKEND_DURATION = registry.histogram("rag_generation_backend_duration_seconds", "Generation latency per backend attempt.", ("backend",))
+LOG_FLUSH_DURATION = registry.histogram("rag_interaction_log_flush_seconds", "Time to write one batch of the interaction log to MongoDB.")
+
+
+class RequestTimings:
+    """
+    Per-stage milliseconds of one request, filled in by every span() that runs while it is current.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + seconds * 1000, 2)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {**self.stages, "total": round((time.perf_counter() - self.started) * 1000, 2)}
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def start_request_timings() -> RequestTimings:
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+@contextmanager
+def span(stage: str):
+    """
+    Times a pipeline stage into rag_stage_duration_seconds (and the current request's timings),
+    counting exceptions that escape it by type.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.inc(stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them until the last body chunk is sent,
+    so streamed answers are measured in full. Paths are route templates, not raw URLs.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500] # Unless a response starts
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], path=path, status=str(status[0]))
+            HTTP_DURATION.observe(time.perf_counter() - started, method=scope["method"], path=path)
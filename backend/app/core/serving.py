@@ -0,0 +1,68 @@
+import gc
+import logging
+import os
+import sys
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+def threads_per_worker(workers: int) -> int:
+    if settings.WORKER_THREADS > 0:
+        return settings.WORKER_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def limit_threads(threads: int):
+    """
+    Caps OpenMP/BLAS threads so N workers do not each start one thread per core.
+    The environment variables only take effect before torch/numpy create their pools, so call this
+    before importing them; torch is also capped directly when it is already loaded.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    # HF tokenizers' own pool is not fork-safe once used
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+def preload_for_fork():
+    """
+    Loads model weights and opens the vector index in the gunicorn master, so forked workers
+    share those pages copy-on-write instead of each holding a copy.
+    Load only: no inference runs here, since thread pools started before fork are unusable in the
+    children, and nothing holding sockets, SQLite handles or ONNX Runtime sessions is created.
+    Each worker still runs its own warm-up after fork.
+    """
+    from app.services.embeddings import get_embedding_service
+    from app.services.vector_store import get_vector_db
+    from app.services.retrieval import get_retrieval_service
+    from app.services.reranker import get_reranker
+    from app.services.generation import get_generation_service
+    from app.services.llm_backends import TransformersBackend
+
+    def load_generator():
+        for backend in get_generation_service().router.plan()[:1]:
+            if isinstance(backend, TransformersBackend):
+                backend.generator
+
+    steps = []
+    if settings.EMBEDDING_BACKEND == "torch":
+        steps.append(("embedding_model", get_embedding_service))
+    if settings.VECTOR_BACKEND == "numpy":
+        steps.append(("vector_index", lambda: get_vector_db().flat_index()))
+    steps.append(("lexical_index", lambda: get_retrieval_service().lexical_index()))
+    steps.append(("reranker", get_reranker))
+    steps.append(("generation", load_generator))
+    for name, load in steps:
+        try:
+            load()
+        except Exception as e:
+            # Workers load it themselves and report it through their own warm-up
+            logger.warning(f"Pre-fork load of {name} failed: {e}")
+
+    # Keep the collector from touching (and so un-sharing) pages of everything loaded so far
+    gc.freeze()
+    logger.info(f"Preloaded models for fork ({gc.get_freeze_count()} objects frozen)")
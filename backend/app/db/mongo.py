@@ -1,38 +1,232 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.core.config import get_settings
+from app.core.metrics import LOG_FLUSH_DURATION
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """
+    Bounded in-memory queue of (collection, document) pairs flushed with insert_many
+    once LOG_FLUSH_BATCH_SIZE entries are queued or LOG_FLUSH_INTERVAL_MS has passed.
+    When the queue is full or MongoDB is unavailable, entries are appended to
+    LOG_SPILL_PATH as JSONL (or dropped and counted if no spill path is set).
+    Spill writes run on the default thread pool, never on the event loop.
+    """
+    def __init__(self, mongo: "MongoDB",
+                 max_size: int = 10000,
+                 batch_size: int = 100,
+                 flush_interval_ms: float = 1000,
+                 spill_path: str = ""):
+        self.mongo = mongo
+        self.max_size = max_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.spill_path = spill_path
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._spills: set = set() # Background spill tasks started by submit()
+        self._spill_lock = threading.Lock() # One writer at a time, so JSONL lines never interleave
+
+        self.enqueued = 0
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.flush_errors = 0
+
+    def _enqueue(self, collection: str, document: Dict[str, Any]) -> bool:
+        # False when the entry has to be spilled instead (shutting down, or queue full)
+        if self._stopping:
+            return False
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._worker = asyncio.create_task(self._run())
+        try:
+            self._queue.put_nowait((collection, document))
+            self.enqueued += 1
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def submit(self, collection: str, document: Dict[str, Any]):
+        """
+        Non-blocking enqueue. Never raises on the request path.
+        """
+        if not self._enqueue(collection, document):
+            task = asyncio.create_task(self._spill([(collection, document)]))
+            self._spills.add(task)
+            task.add_done_callback(self._spills.discard)
+
+    async def asubmit(self, collection: str, document: Dict[str, Any]) -> bool:
+        """
+        submit, but waits for a spill to finish. False only if the entry was dropped.
+        """
+        return self._enqueue(collection, document) or await self._spill([(collection, document)])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch: List[Tuple[str, Dict[str, Any]]] = []
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                deadline = loop.time() + self.flush_interval
+                stop = False
+
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+
+                await self._flush(batch)
+                if stop:
+                    return
+        except asyncio.CancelledError:
+            # drain() timed out: spill whatever this batch has not written yet instead of losing it
+            # (a collection cancelled mid-insert is spilled too, so it may also reach MongoDB)
+            if batch:
+                await self._spill(batch)
+            raise
+
+    async def _flush(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        """
+        Writes the batch, removing entries from it once they are written or spilled.
+        """
+        if self.mongo.db is None:
+            await self._spill(batch)
+            batch.clear()
+            return
+
+        by_collection: Dict[str, List[Dict[str, Any]]] = {}
+        for collection, document in batch:
+            by_collection.setdefault(collection, []).append(document)
+
+        for collection, documents in by_collection.items():
+            started = time.perf_counter()
+            try:
+                await self.mongo.db[collection].insert_many(documents, ordered=False)
+                LOG_FLUSH_DURATION.observe(time.perf_counter() - started)
+                self.written += len(documents)
+            except Exception as e:
+                self.flush_errors += 1
+                logger.warning(f"Failed to write {len(documents)} {collection} entries to MongoDB: {e}")
+                await self._spill([(collection, document) for document in documents])
+            batch[:] = [entry for entry in batch if entry[0] != collection]
+
+    async def _spill(self, entries: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """
+        Appends entries to the spill file off the event loop. False if they were dropped.
+        """
+        if not self.spill_path:
+            self.dropped += len(entries)
+            return False
+        return await asyncio.get_running_loop().run_in_executor(None, self._write_spill, entries)
+
+    def _write_spill(self, entries: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        with self._spill_lock:
+            try:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for collection, document in entries:
+                        f.write(json.dumps({"collection": collection, **document}, default=str) + "\n")
+                self.spilled += len(entries)
+                return True
+            except OSError as e:
+                logger.warning(f"Failed to spill log entries to {self.spill_path}: {e}")
+                self.dropped += len(entries)
+                return False
+
+    async def drain(self, timeout: float = 10.0):
+        """
+        Flushes everything still queued and stops the worker. Used on shutdown.
+        """
+        self._stopping = True
+        if self._worker is not None and not self._worker.done():
+            # The worker keeps consuming, so the sentinel always gets a slot
+            await self._queue.put(None)
+            done, _ = await asyncio.wait({self._worker}, timeout=timeout)
+            if not done:
+                logger.warning("Timed out draining interaction log buffer, spilling the rest")
+                # The worker spills its in-flight batch on cancellation
+                self._worker.cancel()
+                await asyncio.gather(self._worker, return_exceptions=True)
+
+            leftovers = []
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    leftovers.append(item)
+            if leftovers:
+                await self._spill(leftovers)
+
+        if self._spills:
+            await asyncio.gather(*self._spills, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "flush_errors": self.flush_errors,
+        }
 
 class MongoDB:
     client: AsyncIOMotorClient = None
     db = None
 
+    def __init__(self):
+        self.buffer = WriteBehindBuffer(
+            self,
+            max_size=settings.LOG_BUFFER_MAX_SIZE,
+            batch_size=settings.LOG_FLUSH_BATCH_SIZE,
+            flush_interval_ms=settings.LOG_FLUSH_INTERVAL_MS,
+            spill_path=settings.LOG_SPILL_PATH
+        )
+
     def connect(self):
-        self.client = AsyncIOMotorClient(settings.MONGODB_URL)
+        self.client = AsyncIOMotorClient(settings.MONGODB_URL, serverSelectionTimeoutMS=settings.MONGODB_TIMEOUT_MS)
         self.db = self.client[settings.MONGODB_DB_NAME]
         print(f"Connected to MongoDB: {settings.MONGODB_DB_NAME}")
 
+    async def aclose(self):
+        await self.buffer.drain()
+        self.close()
+
     def close(self):
         if self.client:
             self.client.close()
 
-    async def log_interaction(self, 
-                              query: str, 
-                              response: str, 
-                              retrieved_chunks: List[str], 
-                              safety_flag: str,
-                              is_unsafe: bool = False):
+    def log_interaction(self,
+                        query: str,
+                        response: str,
+                        retrieved_chunks: List[str],
+                        safety_flag: str,
+                        is_unsafe: bool = False,
+                        timings_ms: Optional[Dict[str, float]] = None):
         """
-        Logs the user interaction.
+        Logs the user interaction. Buffered: written in batches by WriteBehindBuffer.
         """
-        if self.db is None:
-            # Fallback or reconnect if needed, or raise error
-            # For now, just print if not connected (dev mode safe)
-            print("Warning: Database not connected. Log skipped.")
-            return
-
         log_entry = {
             "query": query,
             "response": response,
@@ -41,7 +235,15 @@ class MongoDB:
             "is_unsafe": is_unsafe,
             "timestamp": datetime.utcnow()
         }
-        
-        await self.db.interactions.insert_one(log_entry)
+        if timings_ms:
+            log_entry["timings_ms"] = timings_ms
+
+        self.buffer.submit("interactions", log_entry)
+
+    async def log_feedback(self, feedback: Dict[str, Any]) -> bool:
+        """
+        Buffered like interactions. False if the entry could be neither queued nor spilled.
+        """
+        return await self.buffer.asubmit("feedback", {**feedback, "timestamp": datetime.utcnow()})
 
 db = MongoDB()
@@ -1,8 +1,17 @@
-from fastapi import FastAPI
+import asyncio
+import time
+# First app import, so PROCESS_STARTED is taken before the rest of the app is imported
+from app.services.warmup import PROCESS_STARTED, get_startup_report, warm_up
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from app.api.routes import router
 from app.core.config import get_settings
+from app.core.concurrency import StageOverloadedError, shutdown_executor
+from app.core.metrics import MetricsMiddleware, run_snapshot_writer
 from app.db.mongo import db
+from app.services.embeddings import close_embedding_batcher
+from app.services.generation import close_generation_service
 from contextlib import asynccontextmanager
 
 settings = get_settings()
@@ -10,10 +19,31 @@ settings = get_settings()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    db.connect()
+    report = get_startup_report()
+    report.phases["imports"] = round((time.perf_counter() - PROCESS_STARTED) * 1000, 1)
+    with report.phase("mongo"):
+        db.connect()
+
+    if settings.WARMUP_ENABLED:
+        # Off the event loop, so liveness probes are answered while models load
+        warmup = asyncio.get_running_loop().run_in_executor(None, warm_up, report)
+        if settings.WARMUP_BLOCKING:
+            await warmup
+    else:
+        report.ready = True
+
+    snapshot_writer = None
+    if settings.METRICS_ENABLED and settings.METRICS_MULTIPROCESS_DIRECTORY:
+        snapshot_writer = asyncio.create_task(run_snapshot_writer())
     yield
-    # Shutdown
-    db.close()
+    # Shutdown (drain buffered logs before closing the client)
+    if snapshot_writer is not None:
+        snapshot_writer.cancel()
+        await asyncio.gather(snapshot_writer, return_exceptions=True)
+    await db.aclose()
+    await close_embedding_batcher()
+    await close_generation_service()
+    shutdown_executor()
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -21,6 +51,18 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+@app.exception_handler(StageOverloadedError)
+async def stage_overloaded_handler(request: Request, exc: StageOverloadedError):
+    # Backpressure: tell clients to retry instead of queueing unbounded work
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server is busy ({exc.stage}). Please retry shortly."},
+        headers={"Retry-After": "1"}
+    )
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(router)
 
 import os
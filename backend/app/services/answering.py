@@ -0,0 +1,196 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from app.core.config import get_settings
+from app.core.concurrency import StageOverloadedError
+from app.core.metrics import SAFETY_FLAGS, RequestTimings, span
+from app.services.safety import get_safety_guard
+from app.services.retrieval import get_retrieval_service
+from app.services.generation import get_generation_service, is_generation_error
+from app.services.cache import get_answer_cache
+from app.db.mongo import db
+
+settings = get_settings()
+
+def _source_title(meta: Dict[str, Any]) -> str:
+    # Display fields are flattened into metadata at ingest time (and lifted out of
+    # original_data for older chunks by the vector store's slim projection)
+    return meta.get("title") or meta.get("source", "Unknown Source")
+
+def extract_sources(retrieval_results: List[Dict[str, Any]]) -> List[str]:
+    sources = []
+    for res in retrieval_results:
+        meta = res.get("metadata") or {}
+        title = _source_title(meta)
+        if "page" in meta:
+            title = f"{title}, p. {meta['page']}"
+        sources.append(title)
+    return sources
+
+def new_context(is_unsafe: bool, safety_flag: str, safety_msg: Optional[str]) -> Dict[str, Any]:
+    return {
+        "is_unsafe": is_unsafe,
+        "safety_flag": safety_flag,
+        "safety_msg": safety_msg,
+        "cached": None,
+        "query_embedding": None,
+        "retrieved_chunks": [],
+        "sources": []
+    }
+
+def cache_answer(query: str, ctx: Dict[str, Any], answer: str):
+    if settings.ANSWER_CACHE_ENABLED and not is_generation_error(answer):
+        get_answer_cache().put(query, ctx["query_embedding"], {
+            "answer": answer,
+            "sources": ctx["sources"],
+            "retrieved_context": ctx["retrieved_chunks"]
+        })
+
+
+def log_answer(query: str, ctx: Dict[str, Any], answer: str, timings: Optional[RequestTimings] = None):
+    """
+    Counts the safety verdict and queues the interaction for the Mongo log,
+    with per-stage timings when LOG_REQUEST_TIMINGS is set.
+    """
+    SAFETY_FLAGS.inc(flag=ctx["safety_flag"])
+    timings_ms = timings.as_dict() if timings is not None and settings.LOG_REQUEST_TIMINGS else None
+    with span("logging"):
+        db.log_interaction(
+            query=query,
+            response=answer,
+            retrieved_chunks=ctx["retrieved_chunks"],
+            safety_flag=ctx["safety_flag"],
+            is_unsafe=ctx["is_unsafe"],
+            timings_ms=timings_ms
+        )
+
+
+class BatchAnswerService:
+    """
+    Answers many queries at once, for evaluation runs and bulk jobs.
+    Each pre-generation stage runs once for the whole batch: keyword safety, one embedding
+    call, semantic safety as one matrix product, and one multi-query vector search.
+    Generation then fans out with bounded concurrency.
+    """
+    def __init__(self, concurrency: int = settings.BATCH_GENERATION_CONCURRENCY,
+                 overload_retries: int = settings.BATCH_OVERLOAD_RETRIES):
+        self.concurrency = max(1, concurrency)
+        self.overload_retries = max(0, overload_retries)
+
+    async def prepare(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """
+        Runs everything before generation and returns one context per query, in the same
+        shape as the single-query /ask path.
+        Raises StageOverloadedError when the embedding or retrieval stage is saturated.
+        """
+        safety_guard = get_safety_guard()
+        with span("safety_keywords"):
+            ctxs = [new_context(*verdict) for verdict in safety_guard.check_queries(queries)]
+        answer_cache = get_answer_cache() if settings.ANSWER_CACHE_ENABLED else None
+        retrieval_service = get_retrieval_service()
+
+        # 1. Exact cache hits skip the model entirely
+        to_embed = []
+        for i, ctx in enumerate(ctxs):
+            if ctx["is_unsafe"]:
+                continue
+            cached = answer_cache.get_exact(queries[i]) if answer_cache else None
+            if cached is not None:
+                ctx.update(cached=cached, retrieved_chunks=cached["retrieved_context"], sources=cached["sources"])
+            else:
+                to_embed.append(i)
+
+        # 2. One embedding call, then semantic safety and the semantic cache on those vectors
+        with span("embedding"):
+            embeddings = await retrieval_service.aembed_queries([queries[i] for i in to_embed])
+        with span("safety_semantic"):
+            verdicts = await safety_guard.acheck_embeddings(embeddings)
+        to_retrieve = []
+        for i, embedding, (is_unsafe, safety_flag, safety_msg) in zip(to_embed, embeddings, verdicts):
+            ctx = ctxs[i]
+            ctx["query_embedding"] = embedding
+            if is_unsafe:
+                ctx.update(is_unsafe=is_unsafe, safety_flag=safety_flag, safety_msg=safety_msg)
+                continue
+            cached = answer_cache.get_similar(embedding) if answer_cache else None
+            if cached is not None:
+                ctx.update(cached=cached, retrieved_chunks=cached["retrieved_context"], sources=cached["sources"])
+            else:
+                to_retrieve.append(i)
+
+        # 3. One multi-query vector search
+        with span("retrieval"):
+            results = await retrieval_service.aretrieve_many(
+                [queries[i] for i in to_retrieve],
+                [ctxs[i]["query_embedding"] for i in to_retrieve]
+            )
+        for i, retrieval_results in zip(to_retrieve, results):
+            ctxs[i]["retrieved_chunks"] = [res["content"] for res in retrieval_results]
+            ctxs[i]["sources"] = extract_sources(retrieval_results)
+        return ctxs
+
+    async def _generate(self, query: str, ctx: Dict[str, Any]) -> str:
+        generation_service = get_generation_service()
+        for attempt in range(self.overload_retries + 1):
+            try:
+                return await generation_service.agenerate_response(query, ctx["retrieved_chunks"], ctx["safety_flag"])
+            except StageOverloadedError:
+                if attempt == self.overload_retries:
+                    return "Error generating response: generation stage is overloaded"
+                # Interactive traffic has priority; back off and retry rather than fail the item
+                await asyncio.sleep(0.25 * 2 ** attempt)
+
+    async def iter_answers(self, queries: List[str],
+                           ctxs: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Yields (index, result) in completion order. Pass ctxs from prepare() to run
+        the pre-generation stages before committing to a response.
+        """
+        if ctxs is None:
+            ctxs = await self.prepare(queries)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def answer_one(i: int) -> Tuple[int, Dict[str, Any]]:
+            query, ctx = queries[i], ctxs[i]
+            if ctx["is_unsafe"]:
+                answer = ctx["safety_msg"]
+            elif ctx["cached"] is not None:
+                answer = ctx["cached"]["answer"]
+            else:
+                async with semaphore:
+                    with span("generation"):
+                        answer = await self._generate(query, ctx)
+                cache_answer(query, ctx, answer)
+
+            log_answer(query, ctx, answer)
+            return i, {
+                "answer": answer,
+                "safety_flag": ctx["safety_flag"],
+                "is_unsafe": ctx["is_unsafe"],
+                "sources": ctx["sources"],
+                "retrieved_context": ctx["retrieved_chunks"]
+            }
+
+        tasks = [asyncio.create_task(answer_one(i)) for i in range(len(queries))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def answer(self, queries: List[str],
+                     ctxs: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        Answers every query and returns the results in input order.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+        async for i, result in self.iter_answers(queries, ctxs):
+            results[i] = result
+        return results
+
+_batch_answer_service = None
+def get_batch_answer_service() -> BatchAnswerService:
+    global _batch_answer_service
+    if _batch_answer_service is None:
+        _batch_answer_service = BatchAnswerService()
+    return _batch_answer_service
@@ -0,0 +1,223 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+from app.core.config import get_settings
+from app.services.vector_store import read_index_version
+
+settings = get_settings()
+
+
+def normalize_query(query: str) -> str:
+    """
+    Canonical form used by the exact-match tier: lowercase, punctuation stripped, whitespace collapsed.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+class _CacheEntry:
+    __slots__ = ("value", "slot", "size", "created")
+
+    def __init__(self, value: Dict[str, Any], slot: int, size: int):
+        self.value = value
+        self.slot = slot
+        self.size = size
+        self.created = time.monotonic()
+
+
+class AnswerCache:
+    """
+    Two-tier response cache.
+    Exact tier: normalized query text. Semantic tier: cosine similarity of query embeddings.
+    Entries are evicted LRU-first by count and estimated memory, expire after a TTL,
+    and the whole cache is dropped when the vector index version changes.
+    """
+    def __init__(self,
+                 max_entries: int = 1000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.92,
+                 version_provider: Optional[Callable[[], str]] = None,
+                 version_check_interval: float = 2.0):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_provider = version_provider
+        self.version_check_interval = version_check_interval
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._slot_keys: List[Optional[str]] = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+        self._matrix: Optional[np.ndarray] = None # max_entries x dim, unit-normalized rows
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._bytes = 0
+        self._version = version_provider() if version_provider else None
+        self._version_checked = time.monotonic()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get_exact(self, query: str) -> Optional[Dict[str, Any]]:
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version()
+            entry = self._lookup(key)
+            if entry is not None:
+                self.exact_hits += 1
+                return entry.value
+            return None
+
+    def get_similar(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        Semantic tier lookup. Counts a miss when nothing is close enough,
+        so call it only after get_exact has missed.
+        """
+        with self._lock:
+            self._check_version()
+            if self._matrix is None or not self._valid.any():
+                self.misses += 1
+                return None
+
+            query_vec = self._normalize(embedding)
+            if query_vec.shape[0] != self._matrix.shape[1]:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ query_vec
+            scores[~self._valid] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                entry = self._lookup(self._slot_keys[best])
+                if entry is not None:
+                    self.semantic_hits += 1
+                    return entry.value
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, embedding: Optional[List[float]], value: Dict[str, Any]):
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version()
+            if key in self._entries:
+                self._remove(key)
+
+            size = self._estimate_size(value, embedding)
+            if size > self.max_bytes:
+                return
+
+            while self._entries and (not self._free_slots or self._bytes + size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            slot = self._free_slots.pop()
+            self._entries[key] = _CacheEntry(value, slot, size)
+            self._slot_keys[slot] = key
+            self._bytes += size
+
+            if embedding is not None:
+                vec = self._normalize(embedding)
+                if self._matrix is None or self._matrix.shape[1] != vec.shape[0]:
+                    self._matrix = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+                    self._valid[:] = False
+                self._matrix[slot] = vec
+                self._valid[slot] = True
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _lookup(self, key: str) -> Optional[_CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl_seconds and time.monotonic() - entry.created > self.ttl_seconds:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._slot_keys[entry.slot] = None
+        self._valid[entry.slot] = False
+        self._free_slots.append(entry.slot)
+        self._bytes -= entry.size
+
+    def _clear(self):
+        self._entries.clear()
+        self._slot_keys = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+        self._valid[:] = False
+        self._bytes = 0
+
+    def _check_version(self):
+        if self.version_provider is None:
+            return
+        now = time.monotonic()
+        if now - self._version_checked < self.version_check_interval:
+            return
+        self._version_checked = now
+        version = self.version_provider()
+        if version != self._version:
+            self._version = version
+            if self._entries:
+                self._clear()
+                self.invalidations += 1
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    @staticmethod
+    def _estimate_size(value: Dict[str, Any], embedding: Optional[List[float]]) -> int:
+        size = 256 # Entry and dict overhead
+        for item in value.values():
+            if isinstance(item, str):
+                size += sys.getsizeof(item)
+            elif isinstance(item, list):
+                size += sum(sys.getsizeof(x) for x in item)
+        if embedding is not None:
+            size += 4 * len(embedding)
+        return size
+
+
+_answer_cache = None
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(
+            max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            max_bytes=settings.ANSWER_CACHE_MAX_BYTES,
+            ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+            similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            version_provider=read_index_version
+        )
+    return _answer_cache
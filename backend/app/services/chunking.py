@@ -1,4 +1,16 @@
-from typing import List
+import re
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+from app.core.config import get_settings
+
+settings = get_settings()
+
+# Sentence ends (., !, ? followed by whitespace) and line breaks
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+def split_sentences(text: str) -> List[str]:
+    sentences = (sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text))
+    return [sentence for sentence in sentences if sentence]
 
 class TextChunker:
     """
@@ -14,17 +26,21 @@ class TextChunker:
         Simple sliding window approach. 
         For more complex splitting, one might use sentence boundaries or recursive splitters.
         """
+        return list(self.iter_text(text))
+
+    def iter_text(self, text: str) -> Iterator[str]:
+        """
+        Generator form of split_text.
+        """
         if not text:
-            return []
+            return
             
-        chunks = []
         start = 0
         text_len = len(text)
         
         while start < text_len:
             end = start + self.chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
+            yield text[start:end]
             
             # Move forward by chunk_size - overlap
             # If we reached the end, break
@@ -32,26 +48,144 @@ class TextChunker:
                 break
                 
             start += self.chunk_size - self.chunk_overlap
-            
-        return chunks
 
     def split_documents(self, documents: List[dict]) -> List[dict]:
         """
         Takes a list of document dicts (content, metadata) and returns chunked documents.
         """
-        chunked_docs = []
+        return list(self.iter_documents(documents))
+
+    def iter_documents(self, documents: Iterable[dict]) -> Iterator[dict]:
+        """
+        Generator form of split_documents, so chunks can stream into embedding
+        without materializing every chunk of a large corpus.
+        """
         for doc in documents:
             content = doc.get("content", "")
             metadata = doc.get("metadata", {})
             
-            text_chunks = self.split_text(content)
-            
-            for i, chunk in enumerate(text_chunks):
-                chunked_docs.append({
+            for i, chunk in enumerate(self.iter_text(content)):
+                yield {
                     "content": chunk,
                     "metadata": {
                         **metadata,
                         "chunk_index": i
                     }
-                })
-        return chunked_docs
+                }
+
+
+class SentenceChunker(TextChunker):
+    """
+    Packs whole sentences into chunks of at most token_budget tokens, measured with the
+    embedding model's tokenizer, with roughly token_overlap tokens of overlap between chunks.
+    Sentences longer than the budget are split on token boundaries.
+
+    Text is processed in segments of about segment_chars characters cut at a sentence
+    boundary, and each segment's sentences are tokenized in one batched call,
+    so very large documents stream through with bounded memory.
+    """
+    def __init__(self, token_budget: int = 200, token_overlap: int = 32, tokenizer=None, segment_chars: int = 100_000):
+        if token_overlap >= token_budget:
+            raise ValueError("token_overlap must be smaller than token_budget")
+        super().__init__(chunk_size=token_budget, chunk_overlap=token_overlap)
+        self.token_budget = token_budget
+        self.token_overlap = token_overlap
+        self.segment_chars = segment_chars
+        self._tokenizer = tokenizer
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(settings.EMBEDDING_MODEL_NAME)
+        return self._tokenizer
+
+    def _iter_sentence_batches(self, text: str) -> Iterator[List[str]]:
+        pos, text_len = 0, len(text)
+        while pos < text_len:
+            end = min(pos + self.segment_chars, text_len)
+            segment = text[pos:end]
+            if end < text_len:
+                # Cut at the last sentence boundary so no sentence straddles two segments;
+                # for a segment with no boundary at all, fall back to the last whitespace
+                last = None
+                for last in _SENTENCE_BOUNDARY.finditer(segment):
+                    pass
+                cut = last.end() if last is not None else segment.rfind(" ") + 1
+                if cut > 0:
+                    segment = segment[:cut]
+                    end = pos + cut
+            yield split_sentences(segment)
+            pos = end
+
+    def _token_lengths(self, sentences: List[str]) -> List[int]:
+        if not sentences:
+            return []
+        encoded = self.tokenizer(sentences, add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def _split_long_sentence(self, sentence: str) -> List[str]:
+        encoded = self.tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = encoded["offset_mapping"]
+        stride = self.token_budget - self.token_overlap
+        pieces = []
+        for start in range(0, len(offsets), stride):
+            window = offsets[start:start + self.token_budget]
+            pieces.append(sentence[window[0][0]:window[-1][1]])
+            if start + self.token_budget >= len(offsets):
+                break
+        return pieces
+
+    def _pack(self, sentences: List[str], lengths: List[int], final: bool) -> Tuple[List[str], int]:
+        """
+        Greedy packing over the cumulative token counts.
+        Returns the chunks and the index of the first sentence not yet fully consumed.
+        """
+        bounds = np.concatenate(([0], np.cumsum(lengths)))
+        n = len(sentences)
+        chunks = []
+        i = 0
+        while i < n:
+            if not final and bounds[n] - bounds[i] <= self.token_budget:
+                break # Wait for the next segment to fill this chunk
+            j = int(np.searchsorted(bounds, bounds[i] + self.token_budget, side="right")) - 1
+            if j <= i:
+                chunks.extend(self._split_long_sentence(sentences[i]))
+                i += 1
+                continue
+            chunks.append(" ".join(sentences[i:j]))
+            if j >= n:
+                i = n
+                break
+            # Next chunk starts at the earliest sentence that keeps the overlap within token_overlap
+            overlap_start = max(int(np.searchsorted(bounds, bounds[j] - self.token_overlap, side="left")), i + 1)
+            # Skip the overlap when the next chunk could not reach past it (e.g. an oversized sentence follows)
+            if int(np.searchsorted(bounds, bounds[overlap_start] + self.token_budget, side="right")) - 1 <= j:
+                overlap_start = j
+            i = overlap_start
+        return chunks, i
+
+    def iter_text(self, text: str) -> Iterator[str]:
+        if not text:
+            return
+
+        pending: List[str] = []
+        pending_lengths: List[int] = []
+        for sentences in self._iter_sentence_batches(text):
+            pending.extend(sentences)
+            pending_lengths.extend(self._token_lengths(sentences))
+            chunks, consumed = self._pack(pending, pending_lengths, final=False)
+            yield from chunks
+            pending, pending_lengths = pending[consumed:], pending_lengths[consumed:]
+
+        chunks, _ = self._pack(pending, pending_lengths, final=True)
+        yield from chunks
+
+
+def get_chunker() -> TextChunker:
+    """
+    Chunker configured by CHUNK_STRATEGY: "sentence" (token-budgeted) or "character" (fixed window).
+    """
+    if settings.CHUNK_STRATEGY == "character":
+        return TextChunker(chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP)
+    return SentenceChunker(token_budget=settings.CHUNK_TOKEN_BUDGET, token_overlap=settings.CHUNK_TOKEN_OVERLAP)
@@ -0,0 +1,105 @@
+import logging
+import re
+from typing import Callable, List
+from app.services.chunking import split_sentences
+from app.services.lexical import tokenize
+
+try:
+    import tiktoken
+except ImportError: # Optional: without it, OpenAI prompts are measured with a character estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Maps a batch of texts to their token counts
+TokenCounter = Callable[[List[str]], List[int]]
+
+def approximate_token_counter(texts: List[str]) -> List[int]:
+    # About four characters per token for English text
+    return [max(1, len(text) // 4) for text in texts]
+
+def tiktoken_counter(model_name: str) -> TokenCounter:
+    if tiktoken is None:
+        return approximate_token_counter
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e: # The BPE files are downloaded on first use
+        logger.warning(f"Could not load tiktoken encoding for {model_name}, estimating tokens instead: {e}")
+        return approximate_token_counter
+    return lambda texts: [len(ids) for ids in encoding.encode_ordinary_batch(texts)] if texts else []
+
+def hf_token_counter(tokenizer) -> TokenCounter:
+    return lambda texts: [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]] if texts else []
+
+_NON_WORD = re.compile(r"\W+")
+
+def _normalize(sentence: str) -> str:
+    return _NON_WORD.sub(" ", sentence.lower()).strip()
+
+
+class ContextBuilder:
+    """
+    Compresses retrieved chunks into a token budget before generation.
+
+    Chunks are split into sentences. Sentences repeated across overlapping chunks, and
+    fragments contained in a longer kept sentence, are dropped. The rest are scored by
+    query-term coverage plus the retrieval rank of their chunk and packed best-first until
+    the budget is spent. Kept sentences come back in their original order, one string per chunk.
+    """
+    # Weight of the chunk's retrieval rank relative to query-term coverage (0..1)
+    RANK_WEIGHT = 0.5
+
+    def __init__(self, count_tokens: TokenCounter, token_budget: int):
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+
+    def _unique_sentences(self, context: List[str]) -> List[tuple]:
+        # (chunk_index, position, sentence, normalized) for each distinct sentence, first occurrence wins
+        sentences, seen = [], set()
+        for chunk_index, chunk in enumerate(context):
+            for position, sentence in enumerate(split_sentences(chunk)):
+                key = _normalize(sentence)
+                if key and key not in seen:
+                    seen.add(key)
+                    sentences.append((chunk_index, position, sentence, key))
+
+        # Chunk overlap cuts sentences at chunk edges; drop pieces of a sentence kept in full
+        padded = [f" {entry[3]} " for entry in sentences]
+        return [
+            entry for entry, piece in zip(sentences, padded)
+            if not any(len(other) > len(piece) and piece in other for other in padded)
+        ]
+
+    def build(self, query: str, context: List[str]) -> List[str]:
+        if not context or self.token_budget <= 0:
+            return list(context)
+
+        sentences = self._unique_sentences(context)
+        if not sentences:
+            return []
+
+        query_terms = set(tokenize(query))
+        scores = []
+        for chunk_index, position, sentence, _ in sentences:
+            coverage = len(query_terms & set(tokenize(sentence))) / len(query_terms) if query_terms else 0.0
+            scores.append(coverage + self.RANK_WEIGHT / (1 + chunk_index))
+
+        # +1 per sentence for the separator it is joined with
+        lengths = [n + 1 for n in self.count_tokens([entry[2] for entry in sentences])]
+        order = sorted(range(len(sentences)), key=lambda i: (-scores[i], sentences[i][0], sentences[i][1]))
+
+        kept, used = set(), 0
+        for i in order:
+            if used + lengths[i] <= self.token_budget:
+                kept.add(i)
+                used += lengths[i]
+        if not kept:
+            kept.add(order[0]) # Best sentence even if it alone exceeds the budget; the model truncates
+
+        by_chunk: List[List[str]] = [[] for _ in context]
+        for i in sorted(kept):
+            by_chunk[sentences[i][0]].append(sentences[i][2])
+        return [" ".join(chunk) for chunk in by_chunk if chunk]
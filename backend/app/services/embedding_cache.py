@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows: fall back to in-process locking only
+    fcntl = None
+
+KEY_SIZE = 16
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, append-only embedding cache for a single model.
+
+    On disk (one directory per model):
+      vectors.f32  row-major float32 matrix, memory-mapped for reads
+      keys.bin     16-byte text digests, row i of vectors belongs to key i
+      meta.json    model name and embedding dimension
+
+    Appends take an exclusive file lock and first pick up rows written by other
+    processes, so the API and ingestion scripts can share one cache directory.
+    """
+    def __init__(self, directory: str, model_name: str, max_rows: int = 1_000_000):
+        self.model_name = model_name
+        self.max_rows = max_rows
+        self.directory = os.path.join(directory, re.sub(r"[^\w.-]+", "__", model_name))
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._keys_path = os.path.join(self.directory, "keys.bin")
+        self._meta_path = os.path.join(self.directory, "meta.json")
+        self._lock_path = os.path.join(self.directory, ".lock")
+
+        self._lock = threading.Lock()
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self._matrix: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+
+        with self._lock, self._file_lock():
+            self._load_meta()
+            self._sync()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        Returns the cached vector for each text, or None where it is not cached.
+        """
+        with self._lock:
+            rows = [self._index.get(text_key(text)) for text in texts]
+            hit_positions = [i for i, row in enumerate(rows) if row is not None]
+            self.hits += len(hit_positions)
+            self.misses += len(rows) - len(hit_positions)
+
+            results: List[Optional[List[float]]] = [None] * len(texts)
+            if hit_positions:
+                matrix = self._mapped()
+                vectors = matrix[[rows[i] for i in hit_positions]].tolist()
+                for i, vector in zip(hit_positions, vectors):
+                    results[i] = vector
+            return results
+
+    def put_many(self, texts: Sequence[str], embeddings: Any):
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or not len(texts):
+            return
+
+        with self._lock, self._file_lock():
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._meta_path, 'w') as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dim}")
+
+            # Pick up rows appended by other processes before deciding what is new
+            self._sync()
+
+            new_keys, new_rows = [], []
+            for i, text in enumerate(texts):
+                key = text_key(text)
+                if key in self._index or key in new_keys:
+                    continue
+                if self._rows + len(new_keys) >= self.max_rows:
+                    break
+                new_keys.append(key)
+                new_rows.append(i)
+
+            if not new_keys:
+                return
+
+            # Vectors first, keys second: a crash in between leaves orphan vectors that _sync ignores
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors[new_rows].tobytes())
+            with open(self._keys_path, 'ab') as f:
+                f.write(b"".join(new_keys))
+
+            for key in new_keys:
+                self._index[key] = self._rows
+                self._rows += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "rows": self._rows,
+            "dim": self.dim,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _load_meta(self):
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as f:
+                self.dim = json.load(f)["dim"]
+
+    def _sync(self):
+        """
+        Reads keys appended since the last sync. Must hold the file lock.
+        """
+        if self.dim is None or not os.path.exists(self._keys_path):
+            return
+        vector_rows = os.path.getsize(self._vectors_path) // (4 * self.dim) if os.path.exists(self._vectors_path) else 0
+        with open(self._keys_path, 'rb') as f:
+            f.seek(self._rows * KEY_SIZE)
+            data = f.read()
+        available = min(self._rows + len(data) // KEY_SIZE, vector_rows)
+        for row in range(self._rows, available):
+            offset = (row - self._rows) * KEY_SIZE
+            self._index.setdefault(data[offset:offset + KEY_SIZE], row)
+        self._rows = max(self._rows, available)
+
+    def _mapped(self) -> np.memmap:
+        if self._matrix is None or self._matrix.shape[0] < self._rows:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+        return self._matrix
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,27 +1,310 @@
-from typing import List
-from sentence_transformers import SentenceTransformer
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
 from app.core.config import get_settings
+from app.core.concurrency import get_stage, StageOverloadedError
+from app.services.embedding_cache import EmbeddingCache
 
 settings = get_settings()
 
+WARMUP_TEXT = "What is yoga?"
+
+# Files written by scripts/export_onnx.py into EMBEDDING_ONNX_DIRECTORY
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model.int8.onnx"
+ONNX_TOKENIZER_FILE = "tokenizer.json"
+ONNX_CONFIG_FILE = "embedding_config.json"
+
 class EmbeddingService:
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def generate_embeddings(self, texts: List[str], persist: bool = True) -> List[List[float]]:
+        """
+        persist=False is for query traffic: the vectors are computed without touching the
+        persistent embedding cache, so raw user queries are never written to disk.
+        """
         raise NotImplementedError
 
-class LocalEmbeddingService(EmbeddingService):
+    def warm_up(self):
+        """
+        Runs one inference so the first request does not pay for lazy initialization.
+        """
+        self.generate_embeddings([WARMUP_TEXT])
+
+class CachedEmbeddingService(EmbeddingService):
+    """
+    In-process model behind the persistent embedding cache; subclasses implement encode().
+    """
+    cache: Optional[EmbeddingCache] = None
+
+    def _open_cache(self, cache_name: str):
+        # cache_name must change whenever the vectors would, so backends never share rows
+        if settings.EMBEDDING_CACHE_ENABLED:
+            self.cache = EmbeddingCache(
+                settings.EMBEDDING_CACHE_DIRECTORY,
+                cache_name,
+                max_rows=settings.EMBEDDING_CACHE_MAX_ROWS
+            )
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def warm_up(self):
+        # Straight to the model: a cache hit would leave it cold
+        self.encode([WARMUP_TEXT])
+
+    def generate_embeddings(self, texts: List[str], persist: bool = True) -> List[List[float]]:
+        if self.cache is None or not persist:
+            embeddings = self.encode(texts)
+            return embeddings.tolist()
+
+        # Only encode texts that have never been embedded by this model
+        results = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            embeddings = self.encode(missing_texts)
+            self.cache.put_many(missing_texts, embeddings)
+            for i, vector in zip(missing, embeddings.tolist()):
+                results[i] = vector
+        return results
+
+class LocalEmbeddingService(CachedEmbeddingService):
     def __init__(self):
-        # Load model once
+        # Load model once (imported here: sentence-transformers pulls in torch)
+        from sentence_transformers import SentenceTransformer
         self.model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
+        self._open_cache(settings.EMBEDDING_MODEL_NAME)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts)
+
+class OnnxEmbeddingService(CachedEmbeddingService):
+    """
+    The same sentence-transformers model exported to ONNX (scripts/export_onnx.py, optionally
+    int8-quantized) and run with ONNX Runtime on CPU. Needs onnxruntime and tokenizers, not torch.
+    Truncation, pooling and normalization follow the exported SentenceTransformer pipeline;
+    scripts/check_embedding_parity.py reports how far the vectors drift from PyTorch.
+    """
+    def __init__(self,
+                 model_dir: str = settings.EMBEDDING_ONNX_DIRECTORY,
+                 quantized: bool = settings.EMBEDDING_ONNX_QUANTIZED,
+                 threads: int = settings.EMBEDDING_ONNX_THREADS,
+                 batch_size: int = 32):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        # Vectors from another model would not be comparable with the ones in the index
+        if config["model_name"] != settings.EMBEDDING_MODEL_NAME:
+            raise ValueError(
+                f"ONNX model in {model_dir} was exported from {config['model_name']}, "
+                f"but EMBEDDING_MODEL_NAME is {settings.EMBEDDING_MODEL_NAME}"
+            )
+        self.pooling = config.get("pooling", "mean")
+        self.normalize = config.get("normalize", True)
+        self.batch_size = max(1, batch_size)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, ONNX_TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(config["max_seq_length"])
+        if self.tokenizer.padding is None:
+            self.tokenizer.enable_padding(pad_id=config.get("pad_id", 0), pad_token=config.get("pad_token", "[PAD]"))
+
+        self.variant = "onnx-int8" if quantized else "onnx"
+        self._open_cache(f"{settings.EMBEDDING_MODEL_NAME}@{self.variant}")
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
 
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        embeddings = self.model.encode(texts)
-        return embeddings.tolist()
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # Batch texts of similar length together to keep padding short
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [
+            self._encode_batch([texts[i] for i in order[start:start + self.batch_size]])
+            for start in range(0, len(order), self.batch_size)
+        ]
+        embeddings = np.empty((len(texts), batches[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(batches)
+        return embeddings
+
+class EmbeddingBatcher:
+    """
+    Dynamic micro-batcher in front of an EmbeddingService, for query traffic (nothing is persisted).
+    Concurrent single-text requests wait up to max_wait_ms (or until max_batch_size is reached)
+    and are encoded together in one generate_embeddings call.
+    """
+    def __init__(self, service: EmbeddingService, max_batch_size: int = 32, max_wait_ms: float = 5.0, max_queue: int = 256):
+        self.service = service
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+
+        # Metrics
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.batch_size_histogram: Dict[int, int] = {}
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = asyncio.create_task(self._collect())
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Embeds a single text, sharing a model forward pass with concurrent callers.
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((text, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise StageOverloadedError("embedding")
+        return await future
+
+    async def _collect(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = batch[0][2] + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    # Window closed, but take whatever is already queued
+                    try:
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Run the batch without blocking collection of the next one
+            task = asyncio.create_task(self._run_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run_batch(self, batch: List[tuple]):
+        started = time.perf_counter()
+        self._record(len(batch), [started - enqueued for _, _, enqueued in batch])
+
+        texts = [text for text, _, _ in batch]
+        try:
+            embeddings = await get_stage("embedding").run(self.service.generate_embeddings, texts, persist=False)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def _record(self, size: int, waits: List[float]):
+        self.batches += 1
+        self.items += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        self.total_queue_wait += sum(waits)
+        self.max_queue_wait = max(self.max_queue_wait, max(waits))
+        # Power-of-two buckets: 1, 2, 4, 8, ...
+        bucket = 1 << (size - 1).bit_length()
+        self.batch_size_histogram[bucket] = self.batch_size_histogram.get(bucket, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "avg_queue_wait_ms": round(1000 * self.total_queue_wait / self.items, 3) if self.items else 0.0,
+            "max_queue_wait_ms": round(1000 * self.max_queue_wait, 3),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_histogram.items())},
+        }
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
 
 # Factory or Singleton to get the service
 _embedding_service = None
 
+def create_embedding_service(backend: str = settings.EMBEDDING_BACKEND) -> EmbeddingService:
+    # "torch" (sentence-transformers), "onnx" (ONNX Runtime, no torch) or "sidecar" (shared inference process)
+    if backend == "onnx":
+        return OnnxEmbeddingService()
+    if backend == "sidecar":
+        from app.services.sidecar import SidecarEmbeddingService
+        return SidecarEmbeddingService()
+    return LocalEmbeddingService()
+
+_embedding_service_lock = threading.Lock() # Warm-up builds it on a worker thread while requests may arrive
+
 def get_embedding_service() -> EmbeddingService:
     global _embedding_service
     if _embedding_service is None:
-        _embedding_service = LocalEmbeddingService()
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                _embedding_service = create_embedding_service()
     return _embedding_service
+
+_embedding_batcher = None
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        _embedding_batcher = EmbeddingBatcher(
+            get_embedding_service(),
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS,
+            max_queue=settings.STAGE_QUEUE_LIMIT * settings.EMBEDDING_BATCH_MAX_SIZE
+        )
+    return _embedding_batcher
+
+async def close_embedding_batcher():
+    # Only if it was ever created; closing must not load the embedding model
+    if _embedding_batcher is not None:
+        await _embedding_batcher.close()
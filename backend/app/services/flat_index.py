@@ -0,0 +1,309 @@
+import json
+import logging
+import operator
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "current.json"
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.bin"
+SCALES_FILE = "scales.f32"
+CENTROIDS_FILE = "centroids.f32"
+RECORDS_FILE = "records.json"
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# Rows scored per matrix product when the stored dtype has to be widened to float32
+BLOCK_ROWS = 16384
+
+_COMPARISONS = {
+    "$eq": operator.eq, "$ne": operator.ne,
+    "$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le,
+    "$in": lambda value, options: value in options,
+    "$nin": lambda value, options: value not in options,
+}
+
+def matches_where(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """
+    Evaluates a Chroma-style metadata filter: {"field": value}, {"field": {"$op": value}}
+    with $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, and {"$and": [...]} / {"$or": [...]}.
+    As in Chroma, a condition on a field the chunk does not have never matches.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        else:
+            if key not in metadata:
+                return False
+            conditions = condition.items() if isinstance(condition, dict) else [("$eq", condition)]
+            for op, operand in conditions:
+                compare = _COMPARISONS.get(op)
+                if compare is None:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+                try:
+                    if not compare(metadata[key], operand):
+                        return False
+                except TypeError: # e.g. "$gt" between a string and a number
+                    return False
+    return True
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+def _spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Clusters unit vectors by cosine similarity. Returns (centroids, assignment per row).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    assignment = np.zeros(len(vectors), dtype=np.int32)
+    for _ in range(iterations):
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            block = vectors[start:start + BLOCK_ROWS]
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        counts = np.bincount(assignment, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = counts == 0
+        # Re-seed empty lists with random rows so every list stays useful
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = _normalize_rows(sums)
+    return centroids.astype(np.float32), assignment
+
+
+class FlatVectorIndex:
+    """
+    Read-only vector index over a memory-mapped matrix of unit-normalized embeddings.
+
+    Exact search is one matrix product plus argpartition per batch of queries. With nlist > 0
+    the rows are grouped by k-means list (IVF) and a query only scans its nprobe closest lists.
+    Rows are stored as float32, float16 or int8 (symmetric, one scale per row). The matrix is
+    mapped read-only, so every worker process on the host shares the same page cache.
+    """
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, RECORDS_FILE), "r", encoding="utf-8") as f:
+            records = json.load(f)
+
+        self.directory = directory
+        self.version = meta["version"]
+        self.dtype = meta["dtype"]
+        self.dim = meta["dim"]
+        self.ids: List[str] = records["ids"]
+        self.documents: List[str] = records["documents"]
+        self.metadatas: List[Dict[str, Any]] = records["metadatas"]
+        count = len(self.ids)
+
+        self.vectors = None
+        if count:
+            self.vectors = np.memmap(os.path.join(directory, VECTORS_FILE), dtype=DTYPES[self.dtype],
+                                     mode="r", shape=(count, self.dim))
+        self.scales = None
+        if self.dtype == "int8" and count:
+            self.scales = np.memmap(os.path.join(directory, SCALES_FILE), dtype=np.float32, mode="r", shape=(count,))
+
+        # IVF: rows are sorted by list; list i spans rows list_offsets[i]:list_offsets[i + 1]
+        self.list_offsets = np.asarray(meta.get("list_offsets") or [], dtype=np.int64)
+        self.centroids = None
+        if len(self.list_offsets) > 1:
+            nlist = len(self.list_offsets) - 1
+            self.centroids = np.fromfile(os.path.join(directory, CENTROIDS_FILE), dtype=np.float32).reshape(nlist, self.dim)
+            self.row_lists = np.repeat(np.arange(nlist), np.diff(self.list_offsets))
+
+        self._masks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._masks_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nlist(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def vector(self, row: int) -> np.ndarray:
+        vector = np.asarray(self.vectors[row], dtype=np.float32)
+        return vector * self.scales[row] if self.scales is not None else vector
+
+    def _scores(self, queries: np.ndarray, rows=None) -> np.ndarray:
+        """
+        Cosine similarities (rows, queries) for all rows, a slice of rows, or an array of row indices.
+        """
+        is_range = rows is None or isinstance(rows, slice)
+        start, stop, _ = (rows or slice(None)).indices(len(self)) if is_range else (0, len(rows), 1)
+        if is_range and self.dtype == "float32":
+            return self.vectors[start:stop] @ queries.T # Straight from the mapped pages, no copy
+        out = np.empty((stop - start, len(queries)), dtype=np.float32)
+        for block_start in range(start, stop, BLOCK_ROWS):
+            block_stop = min(block_start + BLOCK_ROWS, stop)
+            index = slice(block_start, block_stop) if is_range else rows[block_start:block_stop]
+            block = np.asarray(self.vectors[index], dtype=np.float32) @ queries.T
+            if self.scales is not None:
+                block *= np.asarray(self.scales[index])[:, None]
+            out[block_start - start:block_stop - start] = block
+        return out
+
+    def filter_mask(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Boolean mask of rows matching the filter (None for no filter). Recent masks are cached.
+        """
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True, default=str)
+        with self._masks_lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        mask = np.fromiter((matches_where(meta or {}, where) for meta in self.metadatas), dtype=bool, count=len(self))
+        with self._masks_lock:
+            self._masks[key] = mask
+            while len(self._masks) > 128:
+                self._masks.popitem(last=False)
+        return mask
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # scores: (queries, candidates); -inf marks excluded candidates
+        k = min(k, scores.shape[1])
+        if k <= 0:
+            return np.zeros((len(scores), 0), dtype=np.int64), np.zeros((len(scores), 0), dtype=np.float32)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query_embeddings: Sequence[Sequence[float]], k: int,
+               where: Optional[Dict[str, Any]] = None,
+               nprobe: int = settings.VECTOR_IVF_NPROBE) -> List[List[Tuple[int, float]]]:
+        """
+        Returns, per query, up to k (row, cosine similarity) pairs, best first.
+        Filtered searches are exact over the matching rows; unfiltered ones use IVF when built.
+        """
+        queries = _normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        if not len(self):
+            return [[] for _ in range(len(queries))]
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match index dimension {self.dim}")
+
+        mask = self.filter_mask(where)
+        if mask is not None:
+            rows = np.flatnonzero(mask)
+            scores = self._scores(queries, rows).T if len(rows) else np.zeros((len(queries), 0), dtype=np.float32)
+        elif self.nlist and 0 < nprobe < self.nlist:
+            # Score the union of the lists probed by any query once, then hide each query's unprobed lists
+            probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+            probed = np.zeros((len(queries), self.nlist), dtype=bool)
+            np.put_along_axis(probed, probes, True, axis=1)
+            lists = np.flatnonzero(probed.any(axis=0))
+            spans = [slice(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists]
+            rows = np.concatenate([np.arange(span.start, span.stop) for span in spans])
+            scores = np.concatenate([self._scores(queries, span) for span in spans]).T
+            scores[~probed[:, self.row_lists[rows]]] = -np.inf
+        else:
+            rows = None
+            scores = self._scores(queries).T
+
+        top, top_scores = self._top_k(scores, k)
+        results = []
+        for query_top, query_scores in zip(top, top_scores):
+            results.append([
+                (int(rows[i]) if rows is not None else int(i), float(score))
+                for i, score in zip(query_top, query_scores) if score != -np.inf
+            ])
+        return results
+
+
+def current_flat_index_version(directory: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["version"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+def load_flat_index(directory: str) -> Optional[FlatVectorIndex]:
+    """
+    Opens the current build of the index, or None if it was never built.
+    """
+    version = current_flat_index_version(directory)
+    if version is None:
+        return None
+    return FlatVectorIndex(os.path.join(directory, version))
+
+def build_flat_index(vector_db,
+                     directory: str = settings.VECTOR_INDEX_DIRECTORY,
+                     dtype: str = settings.VECTOR_INDEX_DTYPE,
+                     nlist: int = settings.VECTOR_IVF_NLIST) -> FlatVectorIndex:
+    """
+    Snapshots every chunk in Chroma into a new versioned build and atomically points
+    current.json at it. Readers reload on their next check; the previous build is kept
+    so processes still opening it do not fail, older ones are deleted.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported vector index dtype: {dtype}")
+    ids, documents, metadatas, embeddings = vector_db.get_all_embeddings()
+    vectors = _normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)) if ids \
+        else np.zeros((0, 0), dtype=np.float32)
+
+    list_offsets, centroids = None, None
+    nlist = min(nlist, len(ids))
+    if nlist > 1:
+        centroids, assignment = _spherical_kmeans(vectors, nlist)
+        order = np.argsort(assignment, kind="stable")
+        vectors = vectors[order]
+        ids = [ids[i] for i in order]
+        documents = [documents[i] for i in order]
+        metadatas = [metadatas[i] for i in order]
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).tolist()
+
+    version = f"v{time.time_ns()}"
+    build_dir = os.path.join(directory, version)
+    os.makedirs(build_dir, exist_ok=True)
+
+    if dtype == "int8":
+        scales = np.clip(np.abs(vectors).max(axis=1), 1e-12, None) / 127.0 if len(vectors) else np.zeros(0, np.float32)
+        stored = np.round(vectors / scales[:, None]).astype(np.int8) if len(vectors) else vectors.astype(np.int8)
+        scales.astype(np.float32).tofile(os.path.join(build_dir, SCALES_FILE))
+    else:
+        stored = vectors.astype(DTYPES[dtype])
+    stored.tofile(os.path.join(build_dir, VECTORS_FILE))
+    if centroids is not None:
+        centroids.tofile(os.path.join(build_dir, CENTROIDS_FILE))
+
+    with open(os.path.join(build_dir, RECORDS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f)
+    with open(os.path.join(build_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": version,
+            "dtype": dtype,
+            "dim": int(vectors.shape[1]) if len(vectors) else 0,
+            "count": len(ids),
+            "list_offsets": list_offsets,
+            "model_name": settings.EMBEDDING_MODEL_NAME
+        }, f)
+
+    previous = current_flat_index_version(directory)
+    tmp_path = os.path.join(directory, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version}, f)
+    os.replace(tmp_path, os.path.join(directory, CURRENT_FILE))
+
+    for name in os.listdir(directory):
+        if name.startswith("v") and name not in (version, previous) and os.path.isdir(os.path.join(directory, name)):
+            # Memory maps of deleted files stay valid in processes that still hold them
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    logger.info(f"Built vector index {version}: {len(ids)} rows, {dtype}, {nlist if nlist > 1 else 0} lists")
+    return FlatVectorIndex(build_dir)
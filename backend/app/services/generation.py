@@ -1,90 +1,146 @@
-import openai
-from transformers import pipeline
 import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 from app.core.config import get_settings
+from app.core.concurrency import get_stage
+from app.core.metrics import GENERATION_ERRORS
+from app.services.llm_backends import BackendRouter, GenerationBackend, build_backends
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_MESSAGE = "I'm sorry, I couldn't find any relevant information in my knowledge base to answer your question."
+ERROR_PREFIXES = ("[ERROR]", "Error generating response:")
+
+def is_generation_error(answer: str) -> bool:
+    return answer.startswith(ERROR_PREFIXES)
+
+class GenerationInterruptedError(Exception):
+    """
+    Raised by astream_response when a backend fails after part of the answer has been streamed,
+    so callers can tell the partial answer apart from a complete one (and not cache it).
+    """
+
 class GenerationService:
-    def __init__(self):
-        self.use_local = False
-        # Check if API key is present and valid-looking
-        if settings.OPENAI_API_KEY and "your_openai_api_key" not in settings.OPENAI_API_KEY:
-            openai.api_key = settings.OPENAI_API_KEY
-        else:
-            self.use_local = True
-            logger.info("No valid OpenAI API Key found. Initializing local FLAN-T5 model (this may take a moment to download)...")
-            try:
-                # Use google/flan-t5-base for a good balance of speed and quality
-                self.local_generator = pipeline("text2text-generation", model="google/flan-t5-base")
-                logger.info("Local model loaded successfully.")
-            except Exception as e:
-                logger.error(f"Failed to load local model: {e}")
-                self.local_generator = None
-        
+    """
+    Answers from retrieved context through the configured generation backends.
+    Each request tries the backends in the router's order and fails over on errors.
+    """
+    def __init__(self, backends: Optional[List[GenerationBackend]] = None):
+        self.backends = build_backends() if backends is None else backends
+        self.router = BackendRouter(self.backends)
+        logger.info(f"Generation backends: {[backend.name for backend in self.backends]}")
+
+    def _error(self, error: Optional[Exception]) -> str:
+        # Errors reach the client as answer text, so this counter is the only place they show up
+        GENERATION_ERRORS.inc(reason="no_backend" if error is None else "backend_failed")
+        if error is None:
+            return "[ERROR] No generation backend is configured."
+        return f"Error generating response: {str(error)}"
+
     def generate_response(self, query: str, context: list[str], safety_flag: str) -> str:
         """
         Generates a response based on the query and retrieved context.
         Enforces 'answer only from context'.
         """
         if not context:
-            return "I'm sorry, I couldn't find any relevant information in my knowledge base to answer your question."
-
-        context_str = "\n\n".join(context)
-        
-        # System prompt for OpenAI
-        system_prompt = (
-            "You are a knowledgeable Yoga and Wellness assistant. "
-            "Answer the user's question strictly based on the provided Context below. "
-            "If the answer is not in the context, say 'I don't have enough information to answer that.' "
-            "Do not hallucinate or provide outside information. "
-            "Keep your answer concise, accurate, and friendly."
-        )
-        
-        if safety_flag == "SENSITIVE":
-            system_prompt += " The user asked a sensitive question. Be extra careful and purely factual based on context."
-
-        user_prompt = f"Context:\n{context_str}\n\nQuestion: {query}"
-
-        try:
-            if self.use_local:
-                if not self.local_generator:
-                    return "[ERROR] OpenAI Key missing and local model failed to load."
-                
-                # Prepare prompt for FLAN-T5
-                # FLAN-T5 works well with: "Answer the question based on the context: {context} Question: {query}"
-                # We need to be mindful of token limits (512 usually for T5)
-                # We'll take the most relevant chunk or truncate context
-                
-                short_context = context[0] if context else ""
-                # Rough character limit to stay within ~512 tokens
-                if len(short_context) > 1500:
-                    short_context = short_context[:1500]
-                
-                input_text = f"Answer the question based on the context provided. Context: {short_context} Question: {query}"
-                
-                response = self.local_generator(input_text, max_length=200, do_sample=False)
-                return response[0]['generated_text']
-
-            # OpenAI Generation
-            response = openai.ChatCompletion.create(
-                model=settings.LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3, # Low temperature for factualness
-                max_tokens=300
-            )
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            return f"Error generating response: {str(e)}"
+            return NO_CONTEXT_MESSAGE
+
+        error = None
+        for backend in self.router.plan():
+            started = time.perf_counter()
+            try:
+                answer = backend.generate(query, context, safety_flag)
+            except Exception as e:
+                self.router.record(backend, started, ok=False)
+                logger.warning(f"Generation backend {backend.name} failed: {e}")
+                error = e
+                continue
+            self.router.record(backend, started, ok=True)
+            return answer
+        return self._error(error)
+
+    async def agenerate_response(self, query: str, context: list[str], safety_flag: str) -> str:
+        """
+        Async variant of generate_response for the request path.
+        Raises StageOverloadedError when the generation stage is saturated.
+        """
+        if not context:
+            return NO_CONTEXT_MESSAGE
+
+        async with get_stage("generation").slot():
+            error = None
+            for backend in self.router.plan():
+                started = time.perf_counter()
+                try:
+                    answer = await backend.agenerate(query, context, safety_flag)
+                except Exception as e:
+                    self.router.record(backend, started, ok=False)
+                    logger.warning(f"Generation backend {backend.name} failed: {e}")
+                    error = e
+                    continue
+                self.router.record(backend, started, ok=True)
+                return answer
+        return self._error(error)
+
+    async def astream_response(self, query: str, context: list[str], safety_flag: str) -> AsyncIterator[str]:
+        """
+        Streams the answer as text fragments as soon as the model produces them.
+        Fails over to the next backend only before the first fragment; a failure after it
+        raises GenerationInterruptedError.
+        Raises StageOverloadedError (before the first fragment) when the generation stage is saturated.
+        """
+        if not context:
+            yield NO_CONTEXT_MESSAGE
+            return
+
+        async with get_stage("generation").slot():
+            error = None
+            for backend in self.router.plan():
+                started = time.perf_counter()
+                streamed = False
+                try:
+                    async for token in backend.astream(query, context, safety_flag):
+                        streamed = True
+                        yield token
+                except Exception as e:
+                    self.router.record(backend, started, ok=False)
+                    logger.warning(f"Generation backend {backend.name} failed: {e}")
+                    if streamed:
+                        raise GenerationInterruptedError(self._error(e)) from e
+                    error = e
+                    continue
+                self.router.record(backend, started, ok=True)
+                return
+            yield self._error(error)
+
+    def warm_up(self):
+        """
+        Warms the backend requests will try first; fallbacks stay lazy.
+        """
+        plan = self.router.plan()
+        if plan:
+            plan[0].warm_up()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.router.stats()
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.aclose()
 
 _generation_service = None
+_generation_service_lock = threading.Lock() # Warm-up builds it on a worker thread while requests may arrive
 def get_generation_service() -> GenerationService:
     global _generation_service
     if _generation_service is None:
-        _generation_service = GenerationService()
+        with _generation_service_lock:
+            if _generation_service is None:
+                _generation_service = GenerationService()
     return _generation_service
+
+async def close_generation_service():
+    # Only if it was ever created; closing must not load models
+    if _generation_service is not None:
+        await _generation_service.aclose()
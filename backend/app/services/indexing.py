@@ -0,0 +1,369 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from app.core.config import get_settings
+from app.services.ingestion import KnowledgeIngestion
+from app.services.chunking import TextChunker
+from app.services.vector_store import VectorDB, get_vector_db, document_id, bump_index_version
+from app.services.lexical import build_lexical_index, lexical_index_path
+from app.services.flat_index import build_flat_index, current_flat_index_version
+
+settings = get_settings()
+
+MANIFEST_FILE = "ingest_manifest.json"
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    Records, per source file, what was indexed: mtime, size, content hash,
+    chunking settings and the IDs of the chunks it produced.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(settings.CHROMA_PERSIST_DIRECTORY, MANIFEST_FILE)
+        self.exists = os.path.exists(self.path)
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        if self.exists:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.sources = json.load(f).get("sources", {})
+
+    def get(self, source_path: str) -> Optional[Dict[str, Any]]:
+        return self.sources.get(source_path)
+
+    def set(self, source_path: str, entry: Dict[str, Any]):
+        self.sources[source_path] = entry
+
+    def remove(self, source_path: str) -> Optional[Dict[str, Any]]:
+        return self.sources.pop(source_path, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"sources": self.sources}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+
+class IngestProgress:
+    """
+    Periodic progress and throughput reporting for long ingestion runs.
+    """
+    def __init__(self, total_files: int, interval: float = 2.0):
+        self.total_files = total_files
+        self.interval = interval
+        self.files_parsed = 0
+        self.chunks_embedded = 0
+        self.chunks_written = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, files_parsed: int = 0, chunks_embedded: int = 0, chunks_written: int = 0):
+        with self._lock:
+            self.files_parsed += files_parsed
+            self.chunks_embedded += chunks_embedded
+            self.chunks_written += chunks_written
+            now = time.perf_counter()
+            if now - self._last_report >= self.interval:
+                self._last_report = now
+                print(f"  {self.summary()}")
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"[{self.files_parsed}/{self.total_files} files] "
+            f"{self.chunks_embedded} embedded, {self.chunks_written} written, "
+            f"{self.chunks_written / elapsed:.1f} chunks/s"
+        )
+
+
+def _put(q: queue.Queue, item: Any, failures: List[BaseException]):
+    # Bounded put that gives up as soon as a downstream stage has failed
+    while True:
+        if failures:
+            raise failures[0]
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+class KnowledgeIndexer:
+    """
+    Incrementally syncs source files into the vector store.
+    Unchanged files are skipped, changed files are re-chunked and re-embedded,
+    and chunks belonging to changed or deleted files are removed.
+    """
+    def __init__(self,
+                 vector_db: Optional[VectorDB] = None,
+                 chunker: Optional[TextChunker] = None,
+                 manifest: Optional[IngestManifest] = None,
+                 embed_batch_size: int = settings.INGEST_EMBED_BATCH_SIZE,
+                 write_batch_size: int = settings.INGEST_WRITE_BATCH_SIZE,
+                 queue_size: int = settings.INGEST_QUEUE_SIZE):
+        self.vector_db = vector_db or get_vector_db()
+        self.chunker = chunker
+        self.manifest = manifest or IngestManifest()
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.write_batch_size = max(1, write_batch_size)
+        self.queue_size = max(1, queue_size)
+
+    def _chunking_signature(self) -> str:
+        if self.chunker is None:
+            return "none"
+        return f"{type(self.chunker).__name__}:{self.chunker.chunk_size}:{self.chunker.chunk_overlap}"
+
+    def _is_unchanged(self, source_path: str, stat: os.stat_result) -> bool:
+        entry = self.manifest.get(source_path)
+        if entry is None or entry.get("chunking") != self._chunking_signature():
+            return False
+        if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return True
+        # Touched but identical content: refresh the stat fields only
+        if entry["sha256"] == file_sha256(source_path):
+            entry["mtime"] = stat.st_mtime
+            entry["size"] = stat.st_size
+            return True
+        return False
+
+    def _remove_legacy_ids(self):
+        # Collections built before content-addressed IDs used salted "id_<i>_<hash>" IDs,
+        # which would otherwise linger as duplicates of the re-ingested chunks.
+        legacy_ids = [doc_id for doc_id in self.vector_db.list_ids() if doc_id.startswith("id_")]
+        if legacy_ids:
+            print(f"Removing {len(legacy_ids)} legacy chunks with non-deterministic IDs...")
+            self.vector_db.delete_documents(legacy_ids)
+
+    def _parse(self, paths: List[str], workers: int) -> Iterator[Tuple[str, Optional[Iterable[Dict[str, Any]]], Optional[Exception]]]:
+        """
+        Yields (path, documents, error) as files finish parsing.
+        With workers > 1, parsing fans out across a process pool with a bounded number of files in flight.
+        In-process, documents are a lazy iterator, so parse errors can also surface while it is consumed.
+        """
+        if workers <= 1:
+            for path in paths:
+                yield path, KnowledgeIngestion.iter_file(path), None
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            remaining = iter(paths)
+            pending = {pool.submit(KnowledgeIngestion.load_file, path): path for path in islice(remaining, workers * 2)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        docs, error = future.result(), None
+                    except Exception as e:
+                        docs, error = None, e
+                    next_path = next(remaining, None)
+                    if next_path is not None:
+                        pending[pool.submit(KnowledgeIngestion.load_file, next_path)] = next_path
+                    yield path, docs, error
+
+    def _iter_chunks(self, path: str, docs: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        def tagged():
+            for doc in docs:
+                doc["metadata"]["source_path"] = path
+                yield doc
+        return self.chunker.iter_documents(tagged()) if self.chunker is not None else tagged()
+
+    def _embed_stage(self, embed_queue: queue.Queue, write_queue: queue.Queue,
+                     failures: List[BaseException], progress: IngestProgress):
+        while True:
+            batch = embed_queue.get()
+            if batch is None:
+                write_queue.put(None)
+                return
+            if failures:
+                continue # Drain so the producer never blocks on a dead pipeline
+            try:
+                texts = [chunk["content"] for _, chunk in batch]
+                embeddings = self.vector_db.embedding_service.generate_embeddings(texts)
+                progress.add(chunks_embedded=len(batch))
+                write_queue.put((batch, embeddings))
+            except Exception as e:
+                failures.append(e)
+
+    def _write_stage(self, write_queue: queue.Queue, failures: List[BaseException], progress: IngestProgress):
+        ids, texts, embeddings, metadatas = [], [], [], []
+
+        def flush():
+            if ids:
+                self.vector_db.upsert_embeddings(ids, texts, embeddings, metadatas, bump_version=False)
+                progress.add(chunks_written=len(ids))
+                ids.clear(); texts.clear(); embeddings.clear(); metadatas.clear()
+
+        while True:
+            item = write_queue.get()
+            if failures:
+                if item is None:
+                    return
+                continue
+            try:
+                if item is None:
+                    flush()
+                    return
+                batch, batch_embeddings = item
+                for (doc_id, chunk), embedding in zip(batch, batch_embeddings):
+                    ids.append(doc_id)
+                    texts.append(chunk["content"])
+                    embeddings.append(embedding)
+                    metadatas.append(chunk["metadata"])
+                if len(ids) >= self.write_batch_size:
+                    flush()
+            except Exception as e:
+                failures.append(e)
+
+    def _run_pipeline(self, paths: List[str], workers: int, progress: IngestProgress
+                      ) -> Tuple[Dict[str, List[str]], Dict[str, Exception]]:
+        """
+        parse (process pool) -> chunk (generator) -> embed (fixed-size batches) -> write (grouped upserts),
+        with bounded queues between the embed and write stages.
+        Returns the chunk IDs produced per source and the per-source parse errors.
+        """
+        chunk_ids: Dict[str, List[str]] = {}
+        errors: Dict[str, Exception] = {}
+        failures: List[BaseException] = []
+        embed_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        write_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        embed_thread = threading.Thread(target=self._embed_stage, args=(embed_queue, write_queue, failures, progress), daemon=True)
+        write_thread = threading.Thread(target=self._write_stage, args=(write_queue, failures, progress), daemon=True)
+        embed_thread.start()
+        write_thread.start()
+
+        try:
+            seen = set()
+            batch = []
+            for path, docs, error in self._parse(paths, workers):
+                ids = chunk_ids.setdefault(path, [])
+                if error is None:
+                    try:
+                        for chunk in self._iter_chunks(path, docs):
+                            doc_id = document_id(chunk["content"], chunk["metadata"])
+                            if doc_id in seen:
+                                continue
+                            seen.add(doc_id)
+                            ids.append(doc_id)
+                            batch.append((doc_id, chunk))
+                            if len(batch) >= self.embed_batch_size:
+                                _put(embed_queue, batch, failures)
+                                batch = []
+                    except Exception as e:
+                        if failures:
+                            raise
+                        error = e
+
+                progress.add(files_parsed=1)
+                if error is not None:
+                    print(f"  -> Error in {path}: {error}")
+                    errors[path] = error
+
+            if batch:
+                _put(embed_queue, batch, failures)
+        finally:
+            embed_queue.put(None)
+            embed_thread.join()
+            write_thread.join()
+
+        if failures:
+            raise failures[0]
+        return chunk_ids, errors
+
+    def sync(self, files: Iterable[str], root: Optional[str] = None, workers: int = settings.INGEST_WORKERS) -> Dict[str, int]:
+        """
+        Brings the vector store in line with the given files.
+        Manifest entries that no longer exist on disk, or that live under root
+        but were not passed in, have their chunks deleted.
+        """
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0, "chunks": 0}
+        if not self.manifest.exists:
+            self._remove_legacy_ids()
+
+        seen = set()
+        changed = []
+        for file_path in files:
+            source_path = os.path.abspath(file_path)
+            if source_path in seen:
+                continue
+            seen.add(source_path)
+            if self._is_unchanged(source_path, os.stat(source_path)):
+                stats["unchanged"] += 1
+            else:
+                changed.append(source_path)
+
+        if changed:
+            print(f"Indexing {len(changed)} new or changed files ({stats['unchanged']} unchanged)...")
+            progress = IngestProgress(len(changed))
+            chunk_ids, errors = self._run_pipeline(changed, workers, progress)
+            print(f"  {progress.summary()}")
+
+            for source_path in changed:
+                ids = chunk_ids.get(source_path, [])
+                previous = self.manifest.get(source_path)
+                if source_path in errors:
+                    # A file that failed part-way may already have written some chunks;
+                    # drop those that its last good version did not have.
+                    partial = set(ids) - set(previous["chunk_ids"] if previous else [])
+                    self.vector_db.delete_documents(sorted(partial))
+                    stats["failed"] += 1
+                    continue
+
+                if previous:
+                    stale = set(previous["chunk_ids"]) - set(ids)
+                    self.vector_db.delete_documents(sorted(stale))
+                    stats["updated"] += 1
+                else:
+                    stats["added"] += 1
+                stats["chunks"] += len(ids)
+
+                stat = os.stat(source_path)
+                self.manifest.set(source_path, {
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "sha256": file_sha256(source_path),
+                    "chunking": self._chunking_signature(),
+                    "chunk_ids": ids
+                })
+            bump_index_version()
+
+        root_path = os.path.abspath(root) if root else None
+        for source_path in list(self.manifest.sources):
+            if source_path in seen:
+                continue
+            under_root = root_path is not None and source_path.startswith(root_path + os.sep)
+            if under_root or not os.path.exists(source_path):
+                entry = self.manifest.remove(source_path)
+                self.vector_db.delete_documents(entry["chunk_ids"])
+                stats["removed"] += 1
+                print(f"Removed chunks for deleted source {source_path}")
+
+        self.manifest.save()
+
+        # Keep the BM25 index in step with the chunks now in the collection
+        if changed or stats["removed"] or not os.path.exists(lexical_index_path()):
+            index = build_lexical_index(self.vector_db)
+            print(f"Lexical index rebuilt ({len(index)} chunks).")
+
+        # Snapshot for numpy-backed serving; the version bump makes caches drop answers from the old snapshot
+        if settings.VECTOR_BACKEND == "numpy" and (
+                changed or stats["removed"] or current_flat_index_version(settings.VECTOR_INDEX_DIRECTORY) is None):
+            flat_index = build_flat_index(self.vector_db)
+            bump_index_version()
+            print(f"Vector index rebuilt ({len(flat_index)} chunks, {flat_index.dtype}, {flat_index.nlist} lists).")
+        return stats
@@ -1,7 +1,152 @@
 import json
+import multiprocessing
 import os
-from typing import List, Dict, Any
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, TextIO, Tuple
 from pypdf import PdfReader
+from app.core.config import get_settings
+
+settings = get_settings()
+
+# Pages extracted per pool task, rounded up to whole documents
+PDF_PAGES_PER_TASK = 8
+
+def _extract_pages(reader: PdfReader, start: int, stop: int) -> List[str]:
+    # Whitespace is normalized per page, so no full-document string is ever built
+    return [" ".join((reader.pages[i].extract_text() or "").split()) for i in range(start, stop)]
+
+_worker_reader: Optional[Tuple[str, PdfReader]] = None
+def _extract_pages_in_worker(file_path: str, start: int, stop: int) -> List[str]:
+    # Each pool process parses the PDF once and reuses the reader for its later page ranges
+    global _worker_reader
+    if _worker_reader is None or _worker_reader[0] != file_path:
+        _worker_reader = (file_path, PdfReader(file_path))
+    return _extract_pages(_worker_reader[1], start, stop)
+
+def _can_start_pool() -> bool:
+    # Daemon processes cannot have children, and a parser worker already runs
+    # alongside its siblings, so nested pools would only oversubscribe the CPUs.
+    process = multiprocessing.current_process()
+    return not process.daemon and multiprocessing.parent_process() is None
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+def iter_json_array(f: TextIO,
+                    read_size: int = 1 << 16,
+                    max_record_chars: Optional[int] = None) -> Iterator[Tuple[bool, Any]]:
+    """
+    Incrementally parses a JSON document from a text stream with raw_decode.
+    Yields (True, item) for each element of a top-level array, or a single (False, value)
+    when the document is not an array. Memory is bounded by the largest record plus one read.
+    """
+    max_record_chars = max_record_chars or settings.INGEST_JSON_MAX_RECORD_CHARS
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def peek() -> str:
+        # Next non-whitespace character, refilling the buffer as needed ("" at end of input)
+        nonlocal buf, pos, eof
+        while True:
+            pos = _JSON_WHITESPACE.match(buf, pos).end()
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                return ""
+            buf, pos = f.read(read_size), 0
+            eof = not buf
+
+    def decode() -> Any:
+        nonlocal buf, pos, eof
+        peek() # raw_decode does not skip leading whitespace
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A number is only complete once a character that cannot continue it follows
+                # ("[123." or "[1" may be cut at a read boundary)
+                if eof or (end < len(buf) and buf[end] not in _JSON_NUMBER_CHARS):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            pending = len(buf) - pos
+            if pending > max_record_chars:
+                raise ValueError(f"JSON record exceeds {max_record_chars} characters")
+            # Grow reads with the record so large records are not re-parsed once per small read
+            chunk = f.read(max(read_size, pending))
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+    if peek() != "[":
+        value = decode()
+        if peek():
+            raise ValueError("Unexpected data after the top-level JSON value")
+        yield False, value
+        return
+
+    pos += 1
+    if peek() != "]":
+        while True:
+            yield True, decode()
+            separator = peek()
+            if separator == ",":
+                pos += 1
+            elif separator == "]":
+                break
+            else:
+                raise ValueError(f"Expected ',' or ']' in JSON array, found {separator!r}")
+    pos += 1
+    if peek():
+        raise ValueError("Unexpected data after the top-level JSON array")
+
+# Display fields copied from a record into flat, typed chunk metadata (first matching key wins),
+# so sources can be shown without storing or parsing the whole record.
+DISPLAY_FIELDS = {
+    "title": ("title", "name", "heading"),
+    "section": ("section", "chapter", "category"),
+    "page": ("page", "page_number"),
+    "url": ("url", "link", "source_url"),
+}
+
+def display_metadata(record: Dict[str, Any]) -> Dict[str, Any]:
+    metadata = {}
+    for field, keys in DISPLAY_FIELDS.items():
+        value = next((record[key] for key in keys if record.get(key) not in (None, "")), None)
+        if value is None or isinstance(value, (dict, list)):
+            continue
+        if field == "page":
+            try:
+                metadata[field] = int(value)
+            except (TypeError, ValueError):
+                continue
+        else:
+            metadata[field] = str(value)
+    return metadata
+
+def _record_document(item: Any, source: str) -> Dict[str, Any]:
+    # Maps one Q&A / knowledge record to a document. The record is serialized at most once,
+    # and only when it is needed as fallback content or as original_data.
+    serialized = None
+    if isinstance(item, dict) and "content" in item:
+        content = item["content"]
+    elif isinstance(item, dict) and "text" in item:
+        content = item["text"]
+    elif isinstance(item, dict) and "question" in item and "answer" in item:
+        content = f"Question: {item['question']}\nAnswer: {item['answer']}"
+    elif isinstance(item, str):
+        content = item
+    else:
+        serialized = content = json.dumps(item) # Fallback if no specific content field
+
+    metadata = {"source": source}
+    if isinstance(item, dict):
+        metadata.update(display_metadata(item))
+    if settings.INGEST_STORE_ORIGINAL_DATA:
+        metadata["original_data"] = serialized if serialized is not None else json.dumps(item)
+    return {"content": content, "metadata": metadata}
 
 class KnowledgeIngestion:
     """
@@ -11,72 +156,127 @@ class KnowledgeIngestion:
     @staticmethod
     def load_file(file_path: str) -> List[Dict[str, Any]]:
         """
-        Loads a file and returns a list of documents (usually one per file, or multiple for JSON).
+        Loads a file and returns a list of documents (one per file, per JSON object or per PDF page).
         Each document is a dict: {"content": str, "metadata": dict}
         """
+        return list(KnowledgeIngestion.iter_file(file_path))
+
+    @staticmethod
+    def iter_file(file_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        Lazy variant of load_file: JSON records and PDF pages are read as the caller consumes documents.
+        """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
             
         ext = os.path.splitext(file_path)[1].lower()
         
         if ext == ".json":
-            return KnowledgeIngestion._load_json(file_path)
+            yield from KnowledgeIngestion._iter_json(file_path)
+        elif ext in [".jsonl", ".ndjson"]:
+            yield from KnowledgeIngestion._iter_jsonl(file_path)
         elif ext == ".pdf":
-            return KnowledgeIngestion._load_pdf(file_path)
+            yield from KnowledgeIngestion._iter_pdf(file_path)
         elif ext in [".txt", ".md"]:
-            return KnowledgeIngestion._load_text(file_path)
+            yield from KnowledgeIngestion._load_text(file_path)
         else:
             raise ValueError(f"Unsupported file format: {ext}")
 
     @staticmethod
-    def _load_json(file_path: str) -> List[Dict[str, Any]]:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
+    def _iter_json(file_path: str) -> Iterator[Dict[str, Any]]:
         # Expecting JSON to be a list of objects or a single object
         # We need to standardize to {"content": "...", "metadata": ...}
-        # If the JSON structure is specific (e.g. Q&A pairs), we map it here.
-        # For this generic implementation, we assume a flexible structure.
-        
-        docs = []
-        if isinstance(data, list):
-            for item in data:
-                content = json.dumps(item) # Fallback if no specific content field
-                if "content" in item:
-                    content = item["content"]
-                elif "text" in item:
-                    content = item["text"]
-                elif "question" in item and "answer" in item:
-                    content = f"Question: {item['question']}\nAnswer: {item['answer']}"
-                
-                docs.append({
-                    "content": content,
-                    "metadata": {"source": os.path.basename(file_path), "original_data": json.dumps(item)}
-                })
-        elif isinstance(data, dict):
-             # Similar logic for single dict
-             content = json.dumps(data)
-             docs.append({
-                 "content": content,
-                 "metadata": {"source": os.path.basename(file_path)}
-             })
-             
-        return docs
+        # Arrays are parsed incrementally, so only one record is held in memory at a time.
+        source = os.path.basename(file_path)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for is_item, value in iter_json_array(f):
+                if is_item:
+                    yield _record_document(value, source)
+                else:
+                    # Single top-level object: stored whole
+                    yield {
+                        "content": json.dumps(value),
+                        "metadata": {"source": source}
+                    }
+
+    @staticmethod
+    def _iter_jsonl(file_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        One record per line, mapped like the items of a JSON array. Blank lines are skipped.
+        """
+        source = os.path.basename(file_path)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON on line {line_number} of {file_path}: {e}") from e
+                yield _record_document(record, source)
 
     @staticmethod
-    def _load_pdf(file_path: str) -> List[Dict[str, Any]]:
+    def _iter_pdf(file_path: str,
+                  pages_per_document: Optional[int] = None,
+                  workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields one document per page (or per PDF_PAGES_PER_DOCUMENT pages) with 1-based
+        "page" and, for multi-page documents, "page_end" metadata. Empty pages are skipped.
+        Large PDFs are extracted across a process pool, in order, with at most
+        PDF_MAX_PAGES_IN_FLIGHT extracted pages buffered at a time.
+        """
         reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        
-        # Normalize whitespace
-        text = " ".join(text.split())
-        
-        return [{
-            "content": text,
-            "metadata": {"source": os.path.basename(file_path)}
-        }]
+        n_pages = len(reader.pages)
+        title = reader.metadata.title if reader.metadata else None
+        per_document = max(1, pages_per_document or settings.PDF_PAGES_PER_DOCUMENT)
+        workers = workers or settings.PDF_WORKERS or os.cpu_count() or 1
+
+        if workers > 1 and n_pages >= settings.PDF_PARALLEL_MIN_PAGES and _can_start_pool():
+            del reader # Each pool process opens its own
+            blocks = KnowledgeIngestion._iter_pdf_parallel(file_path, n_pages, per_document, workers)
+        else:
+            blocks = (
+                (start, _extract_pages(reader, start, min(start + per_document, n_pages)))
+                for start in range(0, n_pages, per_document)
+            )
+
+        source = os.path.basename(file_path)
+        for start, page_texts in blocks:
+            for offset in range(0, len(page_texts), per_document):
+                pages = page_texts[offset:offset + per_document]
+                content = " ".join(text for text in pages if text)
+                if not content:
+                    continue
+                first_page = start + offset + 1
+                metadata = {"source": source, "page": first_page}
+                if title:
+                    metadata["title"] = str(title)
+                if len(pages) > 1:
+                    metadata["page_end"] = first_page + len(pages) - 1
+                yield {"content": content, "metadata": metadata}
+
+    @staticmethod
+    def _iter_pdf_parallel(file_path: str, n_pages: int, per_document: int, workers: int) -> Iterator[Tuple[int, List[str]]]:
+        """
+        Yields (first_page_index, page_texts) blocks in page order from a process pool.
+        Submission stays a bounded window ahead of the consumer.
+        """
+        block_pages = per_document * max(1, PDF_PAGES_PER_TASK // per_document)
+        window = max(1, settings.PDF_MAX_PAGES_IN_FLIGHT // block_pages)
+        pool = ProcessPoolExecutor(max_workers=min(workers, window))
+        try:
+            pending = deque()
+            for start in range(0, n_pages, block_pages):
+                stop = min(start + block_pages, n_pages)
+                pending.append((start, pool.submit(_extract_pages_in_worker, file_path, start, stop)))
+                if len(pending) >= window:
+                    first, future = pending.popleft()
+                    yield first, future.result()
+            while pending:
+                first, future = pending.popleft()
+                yield first, future.result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
 
     @staticmethod
     def _load_text(file_path: str) -> List[Dict[str, Any]]:
@@ -0,0 +1,157 @@
+import heapq
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+from app.core.config import get_settings
+from app.services.vector_store import slim_metadata
+
+settings = get_settings()
+
+LEXICAL_INDEX_FILE = "bm25_index.json"
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercases, strips diacritics ("Trikoṇāsana" -> "trikonasana") and splits on non-word characters.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return TOKEN_PATTERN.findall(text)
+
+def lexical_index_path() -> str:
+    return os.path.join(settings.CHROMA_PERSIST_DIRECTORY, LEXICAL_INDEX_FILE)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an in-memory inverted index.
+    Built from the same chunks stored in Chroma and persisted next to it as JSON.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[List[int]]] = {} # term -> [[doc_index, term_frequency], ...]
+        self.avg_doc_length = 0.0
+        self._idf: Dict[str, float] = {}
+
+    @classmethod
+    def build(cls, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict[str, Any]], **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        index.ids = list(ids)
+        index.documents = list(documents)
+        index.metadatas = [meta or {} for meta in metadatas]
+        for doc_index, text in enumerate(index.documents):
+            terms = tokenize(text)
+            index.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                index.postings.setdefault(term, []).append([doc_index, tf])
+        index._prepare()
+        return index
+
+    def _prepare(self):
+        n_docs = len(self.doc_lengths)
+        self.avg_doc_length = sum(self.doc_lengths) / n_docs if n_docs else 0.0
+        self._idf = {
+            term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Returns up to k results in the same shape as VectorDB.search, with the BM25 score in 'score'.
+        """
+        if not self.ids:
+            return []
+
+        scores: Dict[int, float] = {}
+        avg_len = self.avg_doc_length or 1.0
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc_index, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / avg_len)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [{
+            "id": self.ids[doc_index],
+            "content": self.documents[doc_index],
+            "metadata": self.metadatas[doc_index],
+            "score": score
+        } for doc_index, score in top]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings
+            }, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.ids = data["ids"]
+        index.documents = data["documents"]
+        index.metadatas = data["metadatas"]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = data["postings"]
+        index._prepare()
+        return index
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Dict[str, Any]]],
+                           weights: Sequence[float],
+                           k: int,
+                           rrf_k: int = 60,
+                           score_keys: Sequence[str] = ("dense_distance", "bm25_score")) -> List[Dict[str, Any]]:
+    """
+    Weighted reciprocal rank fusion: score(d) = sum_i w_i / (rrf_k + rank_i(d)).
+    Results are matched by 'id' and keep the other fields from the first list they appeared in.
+    'score' becomes the fused score (higher is better); each list's own 'score', which are not
+    comparable with each other (a cosine distance and a BM25 score), is kept under its score_keys entry.
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for results, weight, score_key in zip(result_lists, weights, score_keys):
+        if weight <= 0:
+            continue
+        for rank, result in enumerate(results, start=1):
+            entry = fused.get(result["id"])
+            if entry is None:
+                entry = fused[result["id"]] = {**result, "score": 0.0}
+            entry[score_key] = result.get("score")
+            entry["score"] += weight / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:k]
+
+
+def build_lexical_index(vector_db, path: Optional[str] = None) -> BM25Index:
+    """
+    Rebuilds the BM25 index from every chunk currently in the vector store.
+    """
+    ids, documents, metadatas = vector_db.get_all_documents()
+    # The index only serves display fields, so provenance blobs are not copied into it
+    index = BM25Index.build(ids, documents, [slim_metadata(meta) for meta in metadatas])
+    index.save(path or lexical_index_path())
+    return index
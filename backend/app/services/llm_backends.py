@@ -0,0 +1,533 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+import httpx
+from app.core.config import get_settings
+from app.core.concurrency import get_executor, get_stage
+from app.core.metrics import GENERATION_BACKEND_DURATION, GENERATION_BACKEND_REQUESTS
+from app.services.context import ContextBuilder, approximate_token_counter, hf_token_counter, tiktoken_counter
+from app.services.sidecar import SidecarClient
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+def build_messages(query: str, context: List[str], safety_flag: str) -> List[dict]:
+    context_str = "\n\n".join(context)
+
+    # System prompt for OpenAI
+    system_prompt = (
+        "You are a knowledgeable Yoga and Wellness assistant. "
+        "Answer the user's question strictly based on the provided Context below. "
+        "If the answer is not in the context, say 'I don't have enough information to answer that.' "
+        "Do not hallucinate or provide outside information. "
+        "Keep your answer concise, accurate, and friendly."
+    )
+
+    if safety_flag == "SENSITIVE":
+        system_prompt += " The user asked a sensitive question. Be extra careful and purely factual based on context."
+
+    user_prompt = f"Context:\n{context_str}\n\nQuestion: {query}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+class GenerationBackend:
+    """
+    One way of producing an answer from (query, context).
+    Backends raise on failure so the router can fail over to the next one.
+    """
+    name = "backend"
+    remote = False
+
+    def __init__(self, context_builder: Optional[ContextBuilder] = None):
+        self.context_builder = context_builder
+
+    def compress(self, query: str, context: List[str]) -> List[str]:
+        """
+        Deduplicated, highest-scoring sentences of the context within this backend's token budget.
+        """
+        if self.context_builder is None:
+            return context
+        return self.context_builder.build(query, context)
+
+    def generate(self, query: str, context: List[str], safety_flag: str) -> str:
+        raise NotImplementedError
+
+    async def agenerate(self, query: str, context: List[str], safety_flag: str) -> str:
+        raise NotImplementedError
+
+    def astream(self, query: str, context: List[str], safety_flag: str) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def warm_up(self):
+        """
+        Loads whatever the backend needs so the first request does not pay for it.
+        HTTP backends do nothing here: a warm-up completion would be a billed request.
+        """
+        pass
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class OpenAICompatibleBackend(GenerationBackend):
+    """
+    Chat completions over HTTP, against OpenAI or any OpenAI-compatible server (llama.cpp, vLLM).
+    Keep-alive connections are pooled per backend. Transport errors and retryable statuses are
+    retried with full-jitter exponential backoff (honouring Retry-After). With hedge_after_ms set,
+    a second identical request races the first once it has been pending that long, if a generation
+    stage slot is free to bill it against.
+    """
+    def __init__(self,
+                 name: str,
+                 base_url: str,
+                 model: str,
+                 api_key: str = "",
+                 remote: bool = True,
+                 timeout: float = settings.LLM_TIMEOUT_SECONDS,
+                 max_retries: int = settings.LLM_MAX_RETRIES,
+                 retry_base_delay_ms: float = settings.LLM_RETRY_BASE_DELAY_MS,
+                 hedge_after_ms: float = settings.LLM_HEDGE_AFTER_MS,
+                 max_connections: int = settings.LLM_MAX_CONNECTIONS,
+                 context_builder: Optional[ContextBuilder] = None):
+        super().__init__(context_builder)
+        self.name = name
+        self.remote = remote
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_retries = max(0, max_retries)
+        self.retry_base_delay = max(0.0, retry_base_delay_ms) / 1000.0
+        self.hedge_after = max(0.0, hedge_after_ms) / 1000.0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._sync_client: Optional[httpx.Client] = None
+
+        # Metrics
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, headers=self.headers,
+                                             timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    @property
+    def sync_client(self) -> httpx.Client:
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(base_url=self.base_url, headers=self.headers,
+                                             timeout=self.timeout, limits=self.limits)
+        return self._sync_client
+
+    def _payload(self, query: str, context: List[str], safety_flag: str, stream: bool = False) -> Dict[str, Any]:
+        payload = {
+            "model": self.model,
+            "messages": build_messages(query, self.compress(query, context), safety_flag),
+            "temperature": 0.3, # Low temperature for factualness
+            "max_tokens": 300
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> Optional[float]:
+        """
+        Seconds to wait before the next attempt, or None when the failure should not be retried.
+        """
+        if attempt >= self.max_retries:
+            return None
+        if response is not None:
+            if response.status_code not in RETRYABLE_STATUS:
+                return None
+            try:
+                return min(float(response.headers["retry-after"]), 10.0)
+            except (KeyError, ValueError):
+                pass
+        return random.uniform(0, self.retry_base_delay * 2 ** attempt)
+
+    @staticmethod
+    def _answer(data: Dict[str, Any]) -> str:
+        return data["choices"][0]["message"]["content"].strip()
+
+    def _post_sync(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in itertools.count():
+            try:
+                response = self.sync_client.post("/chat/completions", json=payload)
+            except httpx.TransportError:
+                delay = self._retry_delay(attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, response) if response.is_error else None
+                if delay is None:
+                    response.raise_for_status()
+                    return response.json()
+            self.retries += 1
+            time.sleep(delay)
+
+    async def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in itertools.count():
+            try:
+                response = await self.client.post("/chat/completions", json=payload)
+            except httpx.TransportError:
+                delay = self._retry_delay(attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, response) if response.is_error else None
+                if delay is None:
+                    response.raise_for_status()
+                    return response.json()
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def _post_hedged(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.hedge_after <= 0:
+            return await self._post(payload)
+
+        first = asyncio.create_task(self._post(payload))
+        second: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            # Tail latency: race a second request and keep whichever succeeds first.
+            # The hedge holds a generation slot of its own, so upstream load stays within GENERATION_CONCURRENCY
+            async with get_stage("generation").try_slot() as acquired:
+                if not acquired:
+                    self.hedges_skipped += 1
+                    return await first
+                self.hedged += 1
+                second = asyncio.create_task(self._post(payload))
+                pending = {first, second}
+                error: Optional[BaseException] = None
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is second:
+                                self.hedge_wins += 1
+                            return task.result()
+                        error = task.exception()
+                raise error
+        finally:
+            # Also on cancellation (client disconnect): no upstream request outlives its slot
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def generate(self, query: str, context: List[str], safety_flag: str) -> str:
+        return self._answer(self._post_sync(self._payload(query, context, safety_flag)))
+
+    async def agenerate(self, query: str, context: List[str], safety_flag: str) -> str:
+        return self._answer(await self._post_hedged(self._payload(query, context, safety_flag)))
+
+    async def astream(self, query: str, context: List[str], safety_flag: str) -> AsyncIterator[str]:
+        """
+        Streams content deltas from server-sent events. Retries only before the first fragment.
+        """
+        payload = self._payload(query, context, safety_flag, stream=True)
+        streamed = False
+        for attempt in itertools.count():
+            try:
+                async with self.client.stream("POST", "/chat/completions", json=payload) as response:
+                    if response.is_error:
+                        delay = self._retry_delay(attempt, response)
+                        if delay is None:
+                            await response.aread()
+                            response.raise_for_status()
+                    else:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            choices = json.loads(data).get("choices")
+                            text = (choices[0].get("delta") or {}).get("content") if choices else None
+                            if text:
+                                streamed = True
+                                yield text
+                        return
+            except httpx.TransportError:
+                delay = None if streamed else self._retry_delay(attempt)
+                if delay is None:
+                    raise
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedges_skipped": self.hedges_skipped
+        }
+
+
+class TransformersBackend(GenerationBackend):
+    """
+    In-process text2text model (FLAN-T5 by default), run on the inference executor.
+    The pipeline loads on first use or warm-up, so it costs nothing while a remote backend serves.
+    """
+    name = "transformers"
+
+    def __init__(self, model_name: str = settings.LOCAL_MODEL_NAME):
+        super().__init__()
+        self.model_name = model_name
+        self._generator = None
+        self._load_error: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        self.generate("What is yoga?", ["Yoga is a practice."], "SAFE")
+
+    @property
+    def generator(self):
+        with self._lock:
+            if self._generator is None and self._load_error is None:
+                logger.info(f"Loading local model {self.model_name} (this may take a moment to download)...")
+                try:
+                    from transformers import pipeline
+                    self._generator = pipeline("text2text-generation", model=self.model_name)
+                    logger.info("Local model loaded successfully.")
+                    if settings.CONTEXT_COMPRESSION_ENABLED:
+                        self.context_builder = ContextBuilder(
+                            hf_token_counter(self._generator.tokenizer), settings.CONTEXT_TOKEN_BUDGET_LOCAL
+                        )
+                except Exception as e:
+                    logger.error(f"Failed to load local model: {e}")
+                    self._load_error = e
+            if self._generator is None:
+                raise RuntimeError(f"Local model failed to load: {self._load_error}")
+            return self._generator
+
+    def generate(self, query: str, context: List[str], safety_flag: str, **generate_kwargs) -> str:
+        generator = self.generator
+
+        # Prepare prompt for FLAN-T5
+        # FLAN-T5 works well with: "Answer the question based on the context: {context} Question: {query}"
+        # We need to be mindful of token limits (512 usually for T5)
+        if self.context_builder is not None:
+            # Best sentences from every chunk, measured with the model's own tokenizer
+            short_context = " ".join(self.compress(query, context))
+        else:
+            short_context = context[0] if context else ""
+            # Rough character limit to stay within ~512 tokens
+            if len(short_context) > 1500:
+                short_context = short_context[:1500]
+
+        input_text = f"Answer the question based on the context provided. Context: {short_context} Question: {query}"
+
+        response = generator(input_text, max_length=200, do_sample=False, **generate_kwargs)
+        return response[0]['generated_text']
+
+    async def agenerate(self, query: str, context: List[str], safety_flag: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), self.generate, query, context, safety_flag)
+
+    async def astream(self, query: str, context: List[str], safety_flag: str) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        generator = await loop.run_in_executor(get_executor(), lambda: self.generator)
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+        streamer = TextIteratorStreamer(
+            generator.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            timeout=settings.LLM_TIMEOUT_SECONDS
+        )
+
+        # Set when the consumer goes away (client disconnect, cancellation), so the executor
+        # thread stops at the next token instead of generating an answer nobody reads
+        abandoned = threading.Event()
+
+        class StopWhenAbandoned(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs) -> bool:
+                return abandoned.is_set()
+
+        def run():
+            try:
+                return self.generate(
+                    query, context, safety_flag,
+                    streamer=streamer, stopping_criteria=StoppingCriteriaList([StopWhenAbandoned()])
+                )
+            except Exception:
+                streamer.end() # Unblock the consumer
+                raise
+
+        job = loop.run_in_executor(get_executor(), run)
+        try:
+            tokens = iter(streamer)
+            while True:
+                # Blocking queue reads go to the default pool, not the inference threads
+                token = await loop.run_in_executor(None, next, tokens, None)
+                if token is None:
+                    break
+                if token:
+                    yield token
+            await job
+        finally:
+            abandoned.set() # No-op once generation has finished
+
+
+class SidecarBackend(GenerationBackend):
+    """
+    The in-process transformers model, hosted once in the inference sidecar for all API workers.
+    Context compression runs in the sidecar, with the model's own tokenizer. Streaming yields the whole answer at once.
+    """
+    name = "sidecar"
+
+    def __init__(self, client: Optional[SidecarClient] = None):
+        super().__init__()
+        self.client = client or SidecarClient()
+
+    def generate(self, query: str, context: List[str], safety_flag: str) -> str:
+        return self.client.generate(query, context, safety_flag)
+
+    async def agenerate(self, query: str, context: List[str], safety_flag: str) -> str:
+        return await self.client.agenerate(query, context, safety_flag)
+
+    async def astream(self, query: str, context: List[str], safety_flag: str) -> AsyncIterator[str]:
+        yield await self.agenerate(query, context, safety_flag)
+
+
+class LatencyWindow:
+    """
+    Request latencies from the last window_seconds, for a rolling p95.
+    """
+    def __init__(self, window_seconds: float, min_samples: int = 5):
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self._samples: deque = deque() # (monotonic time, latency ms)
+
+    def add(self, latency_ms: float):
+        self._samples.append((time.monotonic(), latency_ms))
+
+    def p95(self) -> Optional[float]:
+        cutoff = time.monotonic() - self.window_seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        if len(self._samples) < self.min_samples:
+            return None
+        latencies = sorted(latency for _, latency in self._samples)
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+class BackendRouter:
+    """
+    Orders backends per request: configured preference order, except that a remote backend
+    whose recent p95 exceeds fallback_p95_ms moves behind the others until its slow samples
+    age out of the window. Failures count as a full timeout, so a failing backend is demoted too.
+    Callers try the backends in plan() order and fail over on errors.
+    """
+    def __init__(self, backends: List[GenerationBackend],
+                 fallback_p95_ms: float = settings.GENERATION_FALLBACK_P95_MS,
+                 window_seconds: float = settings.GENERATION_LATENCY_WINDOW_SECONDS,
+                 failure_penalty_ms: float = settings.LLM_TIMEOUT_SECONDS * 1000):
+        self.backends = backends
+        self.fallback_p95_ms = fallback_p95_ms
+        self.failure_penalty_ms = failure_penalty_ms
+        self._windows = {backend.name: LatencyWindow(window_seconds) for backend in backends}
+        self._requests = {backend.name: 0 for backend in backends}
+        self._failures = {backend.name: 0 for backend in backends}
+
+    def _is_slow(self, backend: GenerationBackend) -> bool:
+        if not backend.remote or self.fallback_p95_ms <= 0:
+            return False
+        p95 = self._windows[backend.name].p95()
+        return p95 is not None and p95 > self.fallback_p95_ms
+
+    def plan(self) -> List[GenerationBackend]:
+        fast = [backend for backend in self.backends if not self._is_slow(backend)]
+        slow = [backend for backend in self.backends if self._is_slow(backend)]
+        return fast + slow
+
+    def record(self, backend: GenerationBackend, started: float, ok: bool):
+        latency_ms = (time.perf_counter() - started) * 1000
+        GENERATION_BACKEND_REQUESTS.inc(backend=backend.name, outcome="ok" if ok else "error")
+        GENERATION_BACKEND_DURATION.observe(latency_ms / 1000, backend=backend.name)
+        self._requests[backend.name] += 1
+        if not ok:
+            self._failures[backend.name] += 1
+            latency_ms = max(latency_ms, self.failure_penalty_ms)
+        self._windows[backend.name].add(latency_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            backend.name: {
+                "requests": self._requests[backend.name],
+                "failures": self._failures[backend.name],
+                "p95_ms": _round(self._windows[backend.name].p95()),
+                "demoted": self._is_slow(backend),
+                **backend.stats()
+            }
+            for backend in self.backends
+        }
+
+
+def build_backends() -> List[GenerationBackend]:
+    """
+    Backends named in GENERATION_BACKENDS, in that order, skipping those that are not configured.
+    """
+    backends: List[GenerationBackend] = []
+    for name in (name.strip() for name in settings.GENERATION_BACKENDS.split(",")):
+        if not name:
+            continue
+        if name == "openai":
+            # Check if API key is present and valid-looking
+            if settings.OPENAI_API_KEY and "your_openai_api_key" not in settings.OPENAI_API_KEY:
+                builder = None
+                if settings.CONTEXT_COMPRESSION_ENABLED:
+                    builder = ContextBuilder(tiktoken_counter(settings.LLM_MODEL), settings.CONTEXT_TOKEN_BUDGET_OPENAI)
+                backends.append(OpenAICompatibleBackend(
+                    "openai", settings.OPENAI_BASE_URL, settings.LLM_MODEL,
+                    api_key=settings.OPENAI_API_KEY, context_builder=builder
+                ))
+        elif name == "local_server":
+            if settings.LOCAL_LLM_BASE_URL:
+                builder = None
+                if settings.CONTEXT_COMPRESSION_ENABLED:
+                    builder = ContextBuilder(approximate_token_counter, settings.CONTEXT_TOKEN_BUDGET_LOCAL_SERVER)
+                backends.append(OpenAICompatibleBackend(
+                    "local_server", settings.LOCAL_LLM_BASE_URL, settings.LOCAL_LLM_MODEL,
+                    remote=False, hedge_after_ms=0, context_builder=builder
+                ))
+        elif name == "transformers":
+            backends.append(TransformersBackend())
+        elif name == "sidecar":
+            backends.append(SidecarBackend())
+        else:
+            logger.warning(f"Unknown generation backend '{name}' ignored")
+    return backends
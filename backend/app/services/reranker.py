@@ -0,0 +1,167 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from app.core.config import get_settings
+from app.core.concurrency import get_stage, StageOverloadedError
+
+settings = get_settings()
+
+class CrossEncoderReranker:
+    """
+    Re-scores (query, chunk) candidate pairs with a small cross-encoder and keeps the best k.
+    Uncached pairs of a call are scored in forward passes of at most batch_size pairs, and pair scores are
+    kept in an LRU cache so repeated queries only score candidates they have not seen.
+    """
+    # While over budget, still score every Nth request so the latency estimate can recover
+    PROBE_EVERY = 50
+
+    def __init__(self,
+                 model_name: str = settings.RERANK_MODEL_NAME,
+                 max_length: int = settings.RERANK_MAX_LENGTH,
+                 batch_size: int = settings.RERANK_BATCH_SIZE,
+                 cache_size: int = settings.RERANK_CACHE_SIZE,
+                 latency_budget_ms: float = settings.RERANK_LATENCY_BUDGET_MS):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, max_length=max_length)
+        self.batch_size = max(1, batch_size)
+        self.cache_size = max(0, cache_size)
+        self.latency_budget_ms = latency_budget_ms
+        self._scores: "OrderedDict[bytes, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ms_per_pair: Optional[float] = None # EWMA of observed scoring cost
+        self._warm = False
+        self._over_budget = 0
+
+        # Metrics
+        self.reranked = 0
+        self.skipped_busy = 0
+        self.skipped_budget = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @staticmethod
+    def _pair_key(query: str, candidate: Dict[str, Any]) -> bytes:
+        # Chunk IDs are content hashes, so they identify the text being scored
+        ref = candidate.get("id") or candidate["content"]
+        return hashlib.blake2b(f"{query}\0{ref}".encode("utf-8"), digest_size=16).digest()
+
+    def estimate_ms(self, queries: List[str], candidate_lists: List[List[Dict[str, Any]]]) -> float:
+        """
+        Expected scoring time for the pairs that are not cached yet (0 before the first measurement).
+        """
+        if self._ms_per_pair is None:
+            return 0.0
+        with self._lock:
+            uncached = sum(
+                1 for query, candidates in zip(queries, candidate_lists)
+                for candidate in candidates if self._pair_key(query, candidate) not in self._scores
+            )
+        return uncached * self._ms_per_pair
+
+    def rerank_many(self, queries: List[str], candidate_lists: List[List[Dict[str, Any]]], k: int) -> List[List[Dict[str, Any]]]:
+        """
+        Returns, per query, its top k candidates by cross-encoder score (added as 'rerank_score').
+        """
+        keys = [[self._pair_key(query, candidate) for candidate in candidates]
+                for query, candidates in zip(queries, candidate_lists)]
+
+        scores: Dict[bytes, float] = {}
+        missing_keys, missing_pairs = [], []
+        with self._lock:
+            for query, candidates, pair_keys in zip(queries, candidate_lists, keys):
+                for candidate, key in zip(candidates, pair_keys):
+                    if key in scores:
+                        continue
+                    score = self._scores.get(key)
+                    if score is None:
+                        scores[key] = 0.0 # Placeholder so a duplicate pair is scored once
+                        missing_keys.append(key)
+                        missing_pairs.append((query, candidate["content"]))
+                    else:
+                        self._scores.move_to_end(key)
+                        scores[key] = score
+            self.cache_hits += len(scores) - len(missing_keys)
+            self.cache_misses += len(missing_keys)
+
+        if missing_pairs:
+            started = time.perf_counter()
+            predicted = self.model.predict(missing_pairs, batch_size=self.batch_size, show_progress_bar=False)
+            per_pair_ms = (time.perf_counter() - started) * 1000 / len(missing_pairs)
+            # The first call includes one-off warm-up cost, so it does not seed the estimate
+            if self._warm:
+                self._ms_per_pair = per_pair_ms if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * per_pair_ms
+            self._warm = True
+
+            with self._lock:
+                for key, score in zip(missing_keys, predicted):
+                    scores[key] = float(score)
+                    if self.cache_size:
+                        self._scores[key] = float(score)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        self.reranked += len(queries)
+        results = []
+        for candidates, pair_keys in zip(candidate_lists, keys):
+            ranked = sorted(
+                ({**candidate, "rerank_score": scores[key]} for candidate, key in zip(candidates, pair_keys)),
+                key=lambda c: c["rerank_score"],
+                reverse=True
+            )
+            results.append(ranked[:k])
+        return results
+
+    def warm_up(self):
+        """
+        Scores one pair so one-off initialization cost is paid before traffic (and kept out of the latency estimate).
+        """
+        self.model.predict([("What is yoga?", "Yoga is a practice.")], show_progress_bar=False)
+        self._warm = True
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        return self.rerank_many([query], [candidates], k)[0]
+
+    async def arerank_many(self, queries: List[str], candidate_lists: List[List[Dict[str, Any]]], k: int) -> List[List[Dict[str, Any]]]:
+        """
+        rerank_many on the inference executor, under the "rerank" stage.
+        Re-ranking is an optimization, so under load (no free rerank slot) or when the estimated
+        scoring time exceeds the latency budget, the first-stage order is returned instead.
+        """
+        first_stage = [candidates[:k] for candidates in candidate_lists]
+        stage = get_stage("rerank")
+        if stage.saturated():
+            self.skipped_busy += 1
+            return first_stage
+        if self.latency_budget_ms > 0 and self.estimate_ms(queries, candidate_lists) > self.latency_budget_ms:
+            self._over_budget += 1
+            if self._over_budget % self.PROBE_EVERY:
+                self.skipped_budget += 1
+                return first_stage
+        try:
+            return await stage.run(self.rerank_many, queries, candidate_lists, k)
+        except StageOverloadedError:
+            self.skipped_busy += 1
+            return first_stage
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "reranked": self.reranked,
+            "skipped_busy": self.skipped_busy,
+            "skipped_budget": self.skipped_budget,
+            "ms_per_pair": round(self._ms_per_pair, 3) if self._ms_per_pair is not None else None,
+            "cached_pairs": len(self._scores),
+            "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+        }
+
+_reranker = None
+_reranker_lock = threading.Lock() # Warm-up builds it on a worker thread while requests may arrive
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    global _reranker
+    if _reranker is None and settings.RERANK_ENABLED:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker()
+    return _reranker
@@ -1,21 +1,186 @@
-from typing import List, Dict, Any
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional
 from app.services.vector_store import get_vector_db
+from app.services.embeddings import get_embedding_batcher
+from app.services.lexical import BM25Index, lexical_index_path, reciprocal_rank_fusion
+from app.services.reranker import get_reranker
 from app.core.config import get_settings
+from app.core.concurrency import get_stage
+from app.core.metrics import span
 
 settings = get_settings()
 
 class RetrievalService:
     def __init__(self):
         self.vector_db = get_vector_db()
+        self._lexical_index: Optional[BM25Index] = None
+        self._lexical_mtime: Optional[float] = None
+        self._lexical_checked = 0.0
+        self._lexical_lock = threading.Lock()
+
+    def lexical_index(self) -> Optional[BM25Index]:
+        """
+        The persisted BM25 index, reloaded when ingestion rewrites it. None if it was never built.
+        """
+        now = time.monotonic()
+        if now - self._lexical_checked < 2.0:
+            return self._lexical_index
+        with self._lexical_lock:
+            self._lexical_checked = now
+            path = lexical_index_path()
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                self._lexical_index, self._lexical_mtime = None, None
+                return None
+            if mtime != self._lexical_mtime:
+                self._lexical_index = BM25Index.load(path)
+                self._lexical_mtime = mtime
+            return self._lexical_index
+
+    def _fuse(self, query: str, dense_results: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        index = self.lexical_index()
+        if index is None:
+            return dense_results[:k]
+        lexical_results = index.search(query, k=settings.HYBRID_CANDIDATES)
+        return reciprocal_rank_fusion(
+            [dense_results, lexical_results],
+            [settings.HYBRID_DENSE_WEIGHT, settings.HYBRID_LEXICAL_WEIGHT],
+            k=k,
+            rrf_k=settings.HYBRID_RRF_K
+        )
+
+    def _candidate_count(self) -> int:
+        count = settings.TOP_K_RETRIEVAL
+        if settings.RETRIEVAL_MODE == "hybrid":
+            count = max(count, settings.HYBRID_CANDIDATES)
+        if settings.RERANK_ENABLED:
+            count = max(count, settings.RERANK_CANDIDATES)
+        return count
+
+    def _finalize(self, query: str, dense_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # First-stage results: RERANK_CANDIDATES of them when a re-ranker picks the final top-k
+        k = settings.RERANK_CANDIDATES if settings.RERANK_ENABLED else settings.TOP_K_RETRIEVAL
+        if settings.RETRIEVAL_MODE == "hybrid":
+            return self._fuse(query, dense_results, k)
+        return dense_results[:k]
+
+    async def _arerank(self, queries: List[str], candidate_lists: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        reranker = get_reranker()
+        if reranker is None:
+            return candidate_lists
+        return await reranker.arerank_many(queries, candidate_lists, settings.TOP_K_RETRIEVAL)
+
+    def lexical_search(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        BM25-only results, or None when no lexical index is available.
+        """
+        index = self.lexical_index()
+        if index is None:
+            return None
+        return index.search(query, k=settings.TOP_K_RETRIEVAL)
+
+    def _lexical_search_many(self, queries: List[str]) -> Optional[List[List[Dict[str, Any]]]]:
+        index = self.lexical_index()
+        if index is None:
+            return None
+        return [index.search(query, k=settings.TOP_K_RETRIEVAL) for query in queries]
+
+    async def alexical_search(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        lexical_search on the inference executor, under the "retrieval" stage: index reloads
+        and BM25 scoring are pure-Python CPU work that must not run on the event loop.
+        """
+        return await get_stage("retrieval").run(self.lexical_search, query)
+
+    async def _afinalize(self, queries: List[str], dense_results: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        if settings.RETRIEVAL_MODE != "hybrid":
+            return [self._finalize(query, dense) for query, dense in zip(queries, dense_results)]
+        # Hybrid fusion scores every query with BM25, so it runs on the executor too
+        with span("lexical"):
+            return await get_stage("retrieval").run(
+                lambda: [self._finalize(query, dense) for query, dense in zip(queries, dense_results)]
+            )
 
     def retrieve(self, query: str) -> List[Dict[str, Any]]:
         """
         Retrieves top-k relevant chunks for the query.
         Returns a list of dicts with 'content', 'metadata', 'score'.
         """
-        results = self.vector_db.search(query, k=settings.TOP_K_RETRIEVAL)
+        if settings.RETRIEVAL_MODE == "lexical":
+            lexical = self.lexical_search(query)
+            if lexical is not None:
+                return lexical
+        results = self._finalize(query, self.vector_db.search(query, k=self._candidate_count()))
+        reranker = get_reranker()
+        if reranker is not None:
+            return reranker.rerank(query, results, settings.TOP_K_RETRIEVAL)
         return results
 
+    async def aembed_query(self, query: str) -> List[float]:
+        """
+        Embeds the query on the inference executor, micro-batched with concurrent requests when enabled.
+        """
+        if settings.EMBEDDING_BATCHING_ENABLED:
+            return await get_embedding_batcher().embed(query)
+        embedding_service = self.vector_db.embedding_service
+        return (await get_stage("embedding").run(embedding_service.generate_embeddings, [query], persist=False))[0]
+
+    async def aretrieve(self, query: str, query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """
+        Async variant of retrieve for the request path.
+        Embedding and vector search each run on the inference executor under their own stage limit.
+        Pass query_embedding to reuse an embedding that was already computed.
+        """
+        if settings.RETRIEVAL_MODE == "lexical":
+            lexical = await self.alexical_search(query)
+            if lexical is not None:
+                return lexical
+
+        if query_embedding is None:
+            query_embedding = await self.aembed_query(query)
+        with span("vector_search"):
+            results = await get_stage("retrieval").run(
+                self.vector_db.search, query, k=self._candidate_count(), query_embedding=query_embedding
+            )
+        candidates = await self._afinalize([query], [results])
+        with span("rerank"):
+            return (await self._arerank([query], candidates))[0]
+
+    async def aembed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embeds many queries in one generate_embeddings call on the inference executor.
+        """
+        if not queries:
+            return []
+        embedding_service = self.vector_db.embedding_service
+        return await get_stage("embedding").run(embedding_service.generate_embeddings, list(queries), persist=False)
+
+    async def aretrieve_many(self, queries: List[str],
+                             query_embeddings: Optional[List[List[float]]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Batched aretrieve: one embedding call, one multi-query vector search and one re-ranking pass for all queries.
+        Returns one result list per query, in order.
+        """
+        if not queries:
+            return []
+        if settings.RETRIEVAL_MODE == "lexical":
+            lexical = await get_stage("retrieval").run(self._lexical_search_many, list(queries))
+            if lexical is not None:
+                return lexical
+
+        if query_embeddings is None:
+            query_embeddings = await self.aembed_queries(queries)
+        with span("vector_search"):
+            results = await get_stage("retrieval").run(
+                self.vector_db.search_many, query_embeddings=query_embeddings, k=self._candidate_count()
+            )
+        candidates = await self._afinalize(list(queries), results)
+        with span("rerank"):
+            return await self._arerank(list(queries), candidates)
+
 _retrieval_service = None
 def get_retrieval_service() -> RetrievalService:
     global _retrieval_service
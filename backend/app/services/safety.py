@@ -1,39 +1,310 @@
-from typing import Tuple, Optional
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from app.core.config import get_settings
+from app.core.concurrency import get_stage
+from app.services.embeddings import EmbeddingService, get_embedding_service
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Highest severity first: when a query matches several categories, the first one wins
+CATEGORY_PRIORITY = ["critical", "pregnancy", "medical"]
+
+_SEPARATORS = re.compile(r"[\s\-_]+")
+# Inflections accepted after a listed term ("killed", "died", "treatments", "diagnosed");
+# the term itself must still start at a word boundary, so "skill", "diet" and "studied" stay safe
+_INFLECTION = r"(?:s|es|d|ed|ing)?"
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercases and collapses whitespace, hyphens and underscores, so "Slip-Disc" matches "slip disc".
+    """
+    return _SEPARATORS.sub(" ", text.lower()).strip()
+
+def _trie_pattern(node: Dict) -> str:
+    # Turns a character trie into a regex whose alternations never share a prefix,
+    # so matching cost tracks query length rather than the number of terms.
+    terminal = "" in node
+    branches, single_chars = [], []
+    for ch in sorted(key for key in node if key):
+        sub = _trie_pattern(node[ch])
+        if sub:
+            branches.append(re.escape(ch) + sub)
+        else:
+            single_chars.append(re.escape(ch))
+    if single_chars:
+        branches.append(single_chars[0] if len(single_chars) == 1 else "[" + "".join(single_chars) + "]")
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 and not terminal else "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if terminal else pattern
+
+def compile_terms(terms: Iterable[str]) -> Optional[re.Pattern]:
+    trie: Dict = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    if not trie:
+        return None
+    return re.compile(r"(?<!\w)(" + _trie_pattern(trie) + ")" + _INFLECTION + r"(?!\w)")
+
+
+class KeywordMatcher:
+    """
+    Single precompiled, word-bounded matcher over every category's terms (plus common inflections).
+    One scan of the query finds all matches; the most severe category is returned.
+    """
+    def __init__(self, categories: Dict[str, List[str]]):
+        self.term_categories: Dict[str, str] = {}
+        # Insert in reverse priority so a term listed in two categories maps to the more severe one
+        for category in reversed(CATEGORY_PRIORITY):
+            for term in categories.get(category, []):
+                normalized = normalize_text(term)
+                if normalized:
+                    self.term_categories[normalized] = category
+        self.pattern = compile_terms(self.term_categories)
+        self._rank = {category: i for i, category in enumerate(CATEGORY_PRIORITY)}
+
+    def match(self, text: str) -> Optional[str]:
+        if self.pattern is None:
+            return None
+        best = None
+        for found in self.pattern.finditer(normalize_text(text)):
+            category = self.term_categories[found.group(1)]
+            if best is None or self._rank[category] < self._rank[best]:
+                best = category
+                if self._rank[best] == 0:
+                    break
+        return best
+
+
+class SemanticSafetyClassifier:
+    """
+    Catches paraphrases the keyword lists miss ("I'm expecting", "after my spinal op").
+    Reuses the query embedding computed for retrieval: one dot product against a matrix
+    of prototype phrase embeddings, so no extra model call per request.
+    """
+
+    PROTOTYPES = {
+        "critical": [
+            "I want to end my life", "I don't want to live anymore", "how can I hurt myself",
+            "ways to harm myself", "I am thinking about taking my own life",
+        ],
+        "pregnancy": [
+            "I'm expecting a baby", "I am pregnant", "yoga while carrying a child",
+            "I am in my second trimester", "poses for expectant mothers", "we are having a baby soon",
+        ],
+        "medical": [
+            "after my spinal operation", "I recently had back surgery", "I have a herniated disc",
+            "my doctor diagnosed me with high blood pressure", "I have a heart problem",
+            "I injured my knee", "recovering from a broken bone", "I have a medical condition",
+        ],
+    }
+
+    def __init__(self, embedding_service: EmbeddingService, threshold: float = 0.6,
+                 prototypes: Optional[Dict[str, List[str]]] = None):
+        self.threshold = threshold
+        prototypes = prototypes or self.PROTOTYPES
+        self.categories = [category for category in CATEGORY_PRIORITY if prototypes.get(category)]
+
+        phrases, labels = [], []
+        for label, category in enumerate(self.categories):
+            phrases.extend(prototypes[category])
+            labels.extend([label] * len(prototypes[category]))
+
+        matrix = np.asarray(embedding_service.generate_embeddings(phrases), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.maximum(norms, 1e-12) # n_prototypes x dim, unit rows
+        self.labels = np.asarray(labels)
+
+    def classify(self, embedding: List[float]) -> Tuple[Optional[str], float]:
+        """
+        Returns (category, similarity) for the most severe category whose closest prototype
+        clears the threshold, or (None, best_similarity).
+        """
+        return self.classify_many([embedding])[0]
+
+    def classify_many(self, embeddings: List[List[float]]) -> List[Tuple[Optional[str], float]]:
+        """
+        classify for a batch of embeddings, as a single matrix product.
+        """
+        vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+        scores = vecs @ self.matrix.T # n_queries x n_prototypes
+
+        best_per_category = np.full((len(vecs), len(self.categories)), -1.0, dtype=np.float32)
+        for label in range(len(self.categories)):
+            best_per_category[:, label] = scores[:, self.labels == label].max(axis=1)
+
+        results = []
+        for row in best_per_category:
+            verdict = (None, float(row.max()) if len(row) else -1.0)
+            for label, category in enumerate(self.categories):
+                if row[label] >= self.threshold:
+                    verdict = (category, float(row[label]))
+                    break
+            results.append(verdict)
+        return results
+
 
 class SafetyGuard:
     """
     Handles safety checks for user queries and responses.
     """
-    
+
+    # Terms match whole words plus _INFLECTION, so derived forms the old substring check caught
+    # ("herniated", "killer", "harmful") are listed explicitly
+
     PREGNANCY_KEYWORDS = [
-        "pregnant", "pregnancy", "trimester", "expecting baby", "prenatal"
+        "pregnant", "pregnancy", "trimester", "expecting baby", "prenatal", "prenatally"
     ]
-    
+
     DISEASE_KEYWORDS = [
-        "hernia", "glaucoma", "blood pressure", "surgery", "fracture", 
-        "detached retina", "sciatica", "slip disc", "epilepsy", "heart condition",
-        "chronic pain", "injury", "diagnose", "cure", "treatment", "medicine"
+        "hernia", "herniated", "herniation", "glaucoma", "glaucomatous", "blood pressure", "surgery", "surgeries",
+        "fracture", "fractures", "detached retina", "sciatica", "slip disc", "slipped disc", "epilepsy",
+        "heart condition", "chronic pain", "chronic painful", "injury", "injuries", "diagnose", "cure",
+        "treatment", "medicine", "painkiller"
+    ]
+
+    CRITICAL_KEYWORDS = [
+        "suicide", "suicidal", "kill", "kills", "killing", "killer", "die", "dies", "dying",
+        "death", "deathly", "harm", "harming", "harmful"
     ]
-    
-    CRITICAL_KEYWORDS = ["suicide", "kill", "die", "death", "harm"]
+
+    def __init__(self, terms_file: Optional[str] = None, reload_interval: float = 5.0):
+        self.terms_file = terms_file if terms_file is not None else settings.SAFETY_TERMS_FILE
+        self.reload_interval = reload_interval
+        self._terms_mtime: Optional[float] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        # Built-in lists until the terms file has been read successfully
+        self.matcher = KeywordMatcher(self._default_terms())
+        self.reload()
+
+    def _default_terms(self) -> Dict[str, List[str]]:
+        return {
+            "critical": list(self.CRITICAL_KEYWORDS),
+            "pregnancy": list(self.PREGNANCY_KEYWORDS),
+            "medical": list(self.DISEASE_KEYWORDS),
+        }
+
+    def _load_terms(self) -> Tuple[Dict[str, List[str]], Optional[float]]:
+        """
+        Built-in lists, with any category present in the terms file replacing its default,
+        and the mtime of the file that was read.
+        File format: {"critical": [...], "pregnancy": [...], "medical": [...]}
+        Raises OSError or ValueError if the file cannot be read or parsed.
+        """
+        categories = self._default_terms()
+        if not self.terms_file or not os.path.exists(self.terms_file):
+            return categories, None
+        mtime = os.path.getmtime(self.terms_file)
+        with open(self.terms_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or not all(isinstance(terms, list) for terms in data.values()):
+            raise ValueError("expected an object mapping categories to lists of terms")
+        for category, terms in data.items():
+            if category in categories:
+                categories[category] = [str(term) for term in terms]
+        return categories, mtime
+
+    def reload(self):
+        """
+        Rebuilds the matcher from the terms file. The swap is atomic for concurrent readers.
+        A file that fails to load keeps the previous matcher and is retried on the next check.
+        """
+        try:
+            categories, mtime = self._load_terms()
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load safety terms from {self.terms_file}, keeping the previous terms: {e}")
+            return
+        matcher = KeywordMatcher(categories)
+        with self._lock:
+            self.matcher = matcher
+            self._terms_mtime = mtime
+
+    def _maybe_reload(self):
+        if not self.terms_file:
+            return
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.terms_file)
+        except OSError:
+            return
+        if mtime != self._terms_mtime:
+            self.reload()
 
     def check_query(self, query: str) -> Tuple[bool, str, Optional[str]]:
         """
         Analyzes the query for safety.
         Returns: (is_unsafe, safety_flag, message)
         """
-        query_lower = query.lower()
-        
+        self._maybe_reload()
+        return self._verdict(self.matcher.match(query))
+
+    def check_embedding(self, query_embedding: List[float]) -> Tuple[bool, str, Optional[str]]:
+        """
+        Semantic tier: classifies the query embedding already computed for retrieval.
+        Same return shape as check_query.
+        """
+        return self._check_embeddings(get_semantic_safety_classifier(), [query_embedding])[0]
+
+    async def acheck_embedding(self, query_embedding: List[float]) -> Tuple[bool, str, Optional[str]]:
+        """
+        check_embedding for the event loop: a classifier not yet built by warm-up is built on the executor.
+        """
+        return self._check_embeddings(await aget_semantic_safety_classifier(), [query_embedding])[0]
+
+    def check_queries(self, queries: List[str]) -> List[Tuple[bool, str, Optional[str]]]:
+        """
+        check_query for a batch of queries.
+        """
+        self._maybe_reload()
+        matcher = self.matcher
+        return [self._verdict(matcher.match(query)) for query in queries]
+
+    def check_embeddings(self, query_embeddings: List[List[float]]) -> List[Tuple[bool, str, Optional[str]]]:
+        """
+        check_embedding for a batch of query embeddings.
+        """
+        return self._check_embeddings(get_semantic_safety_classifier(), query_embeddings)
+
+    async def acheck_embeddings(self, query_embeddings: List[List[float]]) -> List[Tuple[bool, str, Optional[str]]]:
+        """
+        check_embeddings for the event loop, as acheck_embedding.
+        """
+        if not len(query_embeddings):
+            return []
+        return self._check_embeddings(await aget_semantic_safety_classifier(), query_embeddings)
+
+    def _check_embeddings(self, classifier: Optional[SemanticSafetyClassifier],
+                          query_embeddings: List[List[float]]) -> List[Tuple[bool, str, Optional[str]]]:
+        if classifier is None or not len(query_embeddings):
+            return [(False, "SAFE", None) for _ in query_embeddings]
+        return [self._verdict(category) for category, _ in classifier.classify_many(query_embeddings)]
+
+    def _verdict(self, category: Optional[str]) -> Tuple[bool, str, Optional[str]]:
         # 1. Critical Harm Detection
-        if any(word in query_lower for word in self.CRITICAL_KEYWORDS):
+        if category == "critical":
             return True, "BLOCKED", "I cannot assist with this query. If you are in distress, please contact emergency services."
 
         # 2. Pregnancy Detection
-        if any(word in query_lower for word in self.PREGNANCY_KEYWORDS):
+        if category == "pregnancy":
             return True, "UNSAFE", self._get_safety_message("pregnancy")
-            
+
         # 3. Disease/Medical Condition Detection
-        if any(word in query_lower for word in self.DISEASE_KEYWORDS):
+        if category == "medical":
             return True, "UNSAFE", self._get_safety_message("medical")
 
         return False, "SAFE", None
@@ -43,15 +314,37 @@ class SafetyGuard:
         Returns the mandatory structured safety response.
         """
         base_msg = "Your question touches on an area that can be risky without personalized guidance.\n\n"
-        
+
         if context_type == "pregnancy":
             base_msg += "Instead of deep twists or inversions, consider gentle prenatal poses and breathing work.\n"
         elif context_type == "medical":
             base_msg += "Instead of advanced poses, consider gentle restorative poses and breathing work.\n"
-            
+
         base_msg += "Please consult a doctor or certified yoga therapist before attempting these poses."
         return base_msg
 
+_semantic_classifier = None
+_semantic_classifier_lock = threading.Lock() # Warm-up builds it on a worker thread while requests may arrive
+def get_semantic_safety_classifier() -> Optional[SemanticSafetyClassifier]:
+    global _semantic_classifier
+    if _semantic_classifier is None and settings.SAFETY_SEMANTIC_ENABLED:
+        with _semantic_classifier_lock:
+            if _semantic_classifier is None:
+                _semantic_classifier = SemanticSafetyClassifier(
+                    get_embedding_service(),
+                    threshold=settings.SAFETY_SEMANTIC_THRESHOLD
+                )
+    return _semantic_classifier
+
+async def aget_semantic_safety_classifier() -> Optional[SemanticSafetyClassifier]:
+    """
+    get_semantic_safety_classifier without blocking the event loop: building it embeds every
+    prototype phrase, so if warm-up has not done that yet it runs on the embedding stage.
+    """
+    if _semantic_classifier is not None or not settings.SAFETY_SEMANTIC_ENABLED:
+        return _semantic_classifier
+    return await get_stage("embedding").run(get_semantic_safety_classifier)
+
 _safety_guard = None
 def get_safety_guard() -> SafetyGuard:
     global _safety_guard
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.core.config import get_settings
+from app.core.concurrency import get_stage, StageOverloadedError
+from app.services.embeddings import WARMUP_TEXT, EmbeddingBatcher, EmbeddingService
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Wire format: each message is a length-prefixed JSON header, followed by one length-prefixed
+# binary frame when the header says "binary" (embeddings travel as raw float32, not JSON numbers)
+_LENGTH = struct.Struct(">I")
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+# The sidecar only binds its socket once its models are loaded, which can outlast worker startup
+STARTUP_WAIT_SECONDS = 180.0
+
+class SidecarError(RuntimeError):
+    pass
+
+def _frame(payload: bytes) -> bytes:
+    return _LENGTH.pack(len(payload)) + payload
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("Inference sidecar closed the connection")
+        buffer += chunk
+    return bytes(buffer)
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    (size,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return _recv_exactly(sock, size)
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (size,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    if size > MAX_FRAME_BYTES:
+        raise SidecarError(f"Frame of {size} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    return await reader.readexactly(size)
+
+def _check(response: Dict[str, Any]) -> Dict[str, Any]:
+    if response.get("ok"):
+        return response
+    if response.get("overloaded"):
+        # Same backpressure signal as an in-process stage, so the API still answers 503
+        raise StageOverloadedError(response.get("stage", "sidecar"))
+    raise SidecarError(response.get("error", "Inference sidecar request failed"))
+
+
+class SidecarClient:
+    """
+    Client for the inference sidecar. Blocking calls (from executor threads) keep one
+    connection per thread; async calls open a short-lived Unix socket connection each.
+    """
+    def __init__(self, path: str = settings.INFERENCE_SOCKET_PATH, timeout: float = settings.LLM_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def _disconnect(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def request(self, header: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(_frame(json.dumps(header).encode("utf-8")))
+                response = json.loads(_recv_frame(sock))
+                payload = _recv_frame(sock) if response.get("binary") else None
+                return _check(response), payload
+            except (ConnectionError, FileNotFoundError):
+                # A kept-alive connection goes stale when the sidecar restarts: reconnect once
+                self._disconnect()
+                if attempt:
+                    raise
+            except Exception:
+                # e.g. a timeout mid-message leaves the stream unusable
+                self._disconnect()
+                raise
+
+    async def arequest(self, header: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        async def exchange():
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            try:
+                writer.write(_frame(json.dumps(header).encode("utf-8")))
+                await writer.drain()
+                response = json.loads(await _read_frame(reader))
+                payload = await _read_frame(reader) if response.get("binary") else None
+                return response, payload
+            finally:
+                writer.close()
+
+        response, payload = await asyncio.wait_for(exchange(), self.timeout)
+        return _check(response), payload
+
+    def embed(self, texts: List[str], persist: bool = True) -> np.ndarray:
+        response, payload = self.request({"op": "embed", "texts": texts, "persist": persist})
+        return np.frombuffer(payload, dtype=np.float32).reshape(response["shape"])
+
+    def generate(self, query: str, context: List[str], safety_flag: str) -> str:
+        response, _ = self.request({"op": "generate", "query": query, "context": context, "safety_flag": safety_flag})
+        return response["text"]
+
+    async def agenerate(self, query: str, context: List[str], safety_flag: str) -> str:
+        response, _ = await self.arequest({"op": "generate", "query": query, "context": context, "safety_flag": safety_flag})
+        return response["text"]
+
+
+class SidecarEmbeddingService(EmbeddingService):
+    """
+    Embeddings computed by the inference sidecar, so API workers hold no model (or cache) of their own.
+    """
+    def __init__(self, client: Optional[SidecarClient] = None):
+        self.client = client or SidecarClient()
+
+    def warm_up(self):
+        deadline = time.monotonic() + STARTUP_WAIT_SECONDS
+        while True:
+            try:
+                self.generate_embeddings([WARMUP_TEXT])
+                return
+            except (ConnectionError, FileNotFoundError) as e:
+                if time.monotonic() > deadline:
+                    raise
+                logger.info(f"Waiting for inference sidecar at {self.client.path}: {e}")
+                time.sleep(1.0)
+
+    def generate_embeddings(self, texts: List[str], persist: bool = True) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.client.embed(list(texts), persist=persist).tolist()
+
+
+class InferenceSidecar:
+    """
+    One process that owns the local models for every API worker on the host, served over a Unix socket.
+    Small query embedding requests from all connections share forward passes through one EmbeddingBatcher;
+    large or persisted ones (ingestion) are encoded directly. Generation runs under the usual stage limit.
+    """
+    def __init__(self, embedding_service: EmbeddingService, generation_backend=None):
+        self.embedding_service = embedding_service
+        self.generation_backend = generation_backend
+        self.batcher = EmbeddingBatcher(
+            embedding_service,
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS,
+            max_queue=settings.STAGE_QUEUE_LIMIT * settings.EMBEDDING_BATCH_MAX_SIZE
+        )
+
+    async def _embed(self, texts: List[str], persist: bool) -> np.ndarray:
+        if persist or len(texts) >= self.batcher.max_batch_size:
+            vectors = await get_stage("embedding").run(self.embedding_service.generate_embeddings, texts, persist=persist)
+        else:
+            vectors = await asyncio.gather(*(self.batcher.embed(text) for text in texts))
+        return np.asarray(vectors, dtype=np.float32)
+
+    async def _dispatch(self, header: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        op = header.get("op")
+        try:
+            if op == "embed":
+                vectors = await self._embed(header["texts"], header.get("persist", True))
+                return {"ok": True, "binary": True, "shape": list(vectors.shape)}, vectors.tobytes()
+            if op == "generate":
+                if self.generation_backend is None:
+                    return {"ok": False, "error": "This sidecar does not serve generation"}, None
+                async with get_stage("generation").slot():
+                    text = await self.generation_backend.agenerate(
+                        header["query"], header["context"], header.get("safety_flag", "SAFE")
+                    )
+                return {"ok": True, "text": text}, None
+            if op == "stats":
+                return {"ok": True, "embedding_batcher": self.batcher.stats()}, None
+            return {"ok": False, "error": f"Unknown op: {op}"}, None
+        except StageOverloadedError as e:
+            return {"ok": False, "overloaded": True, "stage": e.stage, "error": str(e)}, None
+        except Exception as e:
+            logger.exception(f"Sidecar {op} request failed")
+            return {"ok": False, "error": str(e)}, None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    header = json.loads(await _read_frame(reader))
+                except asyncio.IncompleteReadError:
+                    break # Client closed the connection
+                response, payload = await self._dispatch(header)
+                writer.write(_frame(json.dumps(response).encode("utf-8")))
+                if payload is not None:
+                    writer.write(_frame(payload))
+                await writer.drain()
+        except (ConnectionError, SidecarError) as e:
+            logger.warning(f"Sidecar connection dropped: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self, path: str = settings.INFERENCE_SOCKET_PATH):
+        if os.path.exists(path):
+            os.unlink(path) # Left over from a previous run
+        server = await asyncio.start_unix_server(self._handle, path=path)
+        os.chmod(path, 0o660)
+        logger.info(f"Inference sidecar listening on {path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.close()
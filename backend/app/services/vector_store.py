@@ -1,67 +1,290 @@
-import chromadb
-from chromadb.config import Settings as ChromaSettings
-from typing import List, Dict, Any
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 from app.core.config import get_settings
 from app.services.embeddings import get_embedding_service
+from app.services.ingestion import display_metadata
+from app.services.flat_index import FlatVectorIndex, current_flat_index_version, load_flat_index
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION_FILE = "index_version"
+
+def read_index_version() -> str:
+    """
+    Returns the current index version stamp. Changes whenever documents are written,
+    including from ingestion scripts running in another process.
+    """
+    try:
+        with open(os.path.join(settings.CHROMA_PERSIST_DIRECTORY, INDEX_VERSION_FILE), 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+def bump_index_version() -> str:
+    version = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(settings.CHROMA_PERSIST_DIRECTORY, exist_ok=True)
+    path = os.path.join(settings.CHROMA_PERSIST_DIRECTORY, INDEX_VERSION_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
+
+def document_id(content: str, metadata: Dict[str, Any]) -> str:
+    """
+    Deterministic, content-addressed ID for a chunk.
+    Scoped by source so identical text in two files can be removed independently.
+    """
+    source = metadata.get("source_path") or metadata.get("source", "")
+    return hashlib.sha256(f"{source}\0{content}".encode("utf-8")).hexdigest()[:32]
+
+# Bulky metadata kept only for provenance; stripped from query results unless requested
+HEAVY_METADATA_FIELDS = ("original_data",)
+
+def slim_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not metadata:
+        return {}
+    if not any(field in metadata for field in HEAVY_METADATA_FIELDS):
+        return metadata
+    slim = {key: value for key, value in metadata.items() if key not in HEAVY_METADATA_FIELDS}
+    if "title" not in metadata and "original_data" in metadata:
+        # Chunks ingested before display fields were flattened: lift them from the record
+        try:
+            record = json.loads(metadata["original_data"])
+        except (TypeError, ValueError):
+            record = None
+        if isinstance(record, dict):
+            slim = {**display_metadata(record), **slim}
+    return slim
+
+DEFAULT_INCLUDE = ("documents", "metadatas", "distances")
+# (result key, Chroma include key)
+RESULT_FIELDS = (("content", "documents"), ("metadata", "metadatas"), ("score", "distances"), ("embedding", "embeddings"))
 
 class VectorDB:
-    def __init__(self):
-        # Persistent Client
-        self.client = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIRECTORY)
-        self.embedding_service = get_embedding_service()
-        
-        # Get or create collection
-        self.collection = self.client.get_or_create_collection(
-            name="yoga_knowledge_base",
-            metadata={"hnsw:space": "cosine"}
-        )
+    """
+    Chroma is the store of record. With VECTOR_BACKEND=numpy, searches are served from the
+    memory-mapped FlatVectorIndex snapshot instead, and Chroma is only opened for writes.
+    """
+    def __init__(self, backend: str = settings.VECTOR_BACKEND):
+        self.backend = backend
+        self._client = None
+        self._collection = None
+        self._flat_index: Optional[FlatVectorIndex] = None
+        self._flat_checked = 0.0
+        self._flat_lock = threading.Lock()
+        self._flat_missing_logged = False
+
+    @property
+    def embedding_service(self):
+        # Resolved on use, so opening the index (e.g. pre-fork) does not create an embedding session
+        return get_embedding_service()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            # Persistent Client (imported here so numpy-backed serving never loads Chroma)
+            import chromadb
+            self._client = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIRECTORY)
 
-    def add_documents(self, documents: List[Dict[str, Any]]):
+            # Get or create collection
+            self._collection = self._client.get_or_create_collection(
+                name="yoga_knowledge_base",
+                metadata={"hnsw:space": "cosine"}
+            )
+        return self._collection
+
+    def flat_index(self) -> Optional[FlatVectorIndex]:
+        """
+        The current numpy index build, reloaded when ingestion publishes a new one. None if never built.
+        """
+        now = time.monotonic()
+        if now - self._flat_checked < 2.0:
+            return self._flat_index
+        with self._flat_lock:
+            self._flat_checked = now
+            version = current_flat_index_version(settings.VECTOR_INDEX_DIRECTORY)
+            if version is None:
+                self._flat_index = None
+            elif self._flat_index is None or self._flat_index.version != version:
+                self._flat_index = load_flat_index(settings.VECTOR_INDEX_DIRECTORY)
+            return self._flat_index
+
+    def _serving_index(self) -> Optional[FlatVectorIndex]:
+        if self.backend != "numpy":
+            return None
+        index = self.flat_index()
+        if index is None and not self._flat_missing_logged:
+            logger.warning("VECTOR_BACKEND=numpy but no vector index has been built yet; searching Chroma")
+            self._flat_missing_logged = True
+        return index
+
+    def count(self) -> int:
+        index = self._serving_index()
+        return len(index) if index is not None else self.collection.count()
+
+    def add_documents(self, documents: List[Dict[str, Any]]) -> List[str]:
         """
-        Embeds and stores documents.
+        Embeds and stores documents. Re-adding the same content is idempotent.
         documents: List of dicts with 'content' and 'metadata'.
+        Returns the IDs of the stored documents.
         """
         if not documents:
-            return
+            return []
+
+        # Collapse duplicate chunks (same source and text) before embedding
+        unique = {}
+        for doc in documents:
+            unique.setdefault(document_id(doc["content"], doc["metadata"]), doc)
 
-        texts = [doc["content"] for doc in documents]
-        metadatas = [doc["metadata"] for doc in documents]
-        ids = [f"id_{i}_{hash(text)}" for i, text in enumerate(texts)] # Simple ID generation
+        ids = list(unique.keys())
+        texts = [doc["content"] for doc in unique.values()]
+        metadatas = [doc["metadata"] for doc in unique.values()]
         
         # Generate embeddings
         embeddings = self.embedding_service.generate_embeddings(texts)
         
-        self.collection.add(
+        self.upsert_embeddings(ids, texts, embeddings, metadatas)
+        return ids
+
+    def upsert_embeddings(self,
+                          ids: List[str],
+                          texts: List[str],
+                          embeddings: List[List[float]],
+                          metadatas: List[Dict[str, Any]],
+                          bump_version: bool = True):
+        """
+        Stores documents whose embeddings were computed by the caller.
+        """
+        self.collection.upsert(
             documents=texts,
             embeddings=embeddings,
             metadatas=metadatas,
             ids=ids
         )
+        if bump_version:
+            bump_index_version()
 
-    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+    def delete_documents(self, ids: List[str]):
+        if not ids:
+            return
+        self.collection.delete(ids=list(ids))
+        bump_index_version()
+
+    def list_ids(self) -> List[str]:
+        return self.collection.get(include=[])["ids"]
+
+    def get_all_documents(self) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
         """
-        Semantic search.
+        Returns (ids, documents, metadatas) for every stored chunk.
         """
-        query_embedding = self.embedding_service.generate_embeddings([query])[0]
-        
+        results = self.collection.get(include=["documents", "metadatas"])
+        return results["ids"], results["documents"], results["metadatas"] or [{} for _ in results["ids"]]
+
+    def get_all_embeddings(self) -> Tuple[List[str], List[str], List[Dict[str, Any]], List[List[float]]]:
+        """
+        Returns (ids, documents, metadatas, embeddings) for every stored chunk, from Chroma.
+        """
+        results = self.collection.get(include=["documents", "metadatas", "embeddings"])
+        metadatas = results["metadatas"] or [{} for _ in results["ids"]]
+        return results["ids"], results["documents"], [meta or {} for meta in metadatas], results["embeddings"]
+
+    def search(self, query: str, k: int = 3,
+               query_embedding: Optional[List[float]] = None,
+               where: Optional[Dict[str, Any]] = None,
+               include: Sequence[str] = DEFAULT_INCLUDE,
+               include_original_data: bool = False) -> List[Dict[str, Any]]:
+        """
+        Semantic search. Pass query_embedding when it was already computed so the query is not encoded again.
+        """
+        if query_embedding is None:
+            return self.search_many([query], k=k, where=where, include=include,
+                                    include_original_data=include_original_data)[0]
+        return self.search_many(query_embeddings=[query_embedding], k=k, where=where, include=include,
+                                include_original_data=include_original_data)[0]
+
+    def search_many(self,
+                    queries: Optional[List[str]] = None,
+                    query_embeddings: Optional[List[List[float]]] = None,
+                    k: int = 3,
+                    where: Optional[Dict[str, Any]] = None,
+                    include: Sequence[str] = DEFAULT_INCLUDE,
+                    include_original_data: bool = False) -> List[List[Dict[str, Any]]]:
+        """
+        Batched semantic search: one collection query for all inputs, one result list per input, in order.
+        Pass either queries (encoded together in one call) or precomputed query_embeddings.
+        where is a Chroma metadata filter, e.g. {"source": "manual.pdf"} or {"page": {"$lte": 10}}.
+        include selects what Chroma returns ("documents", "metadatas", "distances", "embeddings");
+        each result has "id" plus "content", "metadata", "score" and "embedding" for the included fields.
+        """
+        if (queries is None) == (query_embeddings is None):
+            raise ValueError("Pass exactly one of queries or query_embeddings")
+        if query_embeddings is None:
+            if not queries:
+                return []
+            query_embeddings = self.embedding_service.generate_embeddings(list(queries), persist=False)
+        if not len(query_embeddings):
+            return []
+
+        index = self._serving_index()
+        if index is not None:
+            return self._search_flat(index, query_embeddings, k, where, include, include_original_data)
+
         results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k
+            query_embeddings=query_embeddings,
+            n_results=k,
+            where=where or None,
+            include=list(include)
         )
-        
+
         # Format results
-        # Chroma returns lists of lists
+        # Chroma returns lists of lists, one inner list per query embedding
+        fields = [(name, key) for name, key in RESULT_FIELDS if key in include and results.get(key) is not None]
+        formatted_results = []
+        for q in range(len(query_embeddings)):
+            query_results = []
+            for i, doc_id in enumerate(results["ids"][q]):
+                result = {"id": doc_id}
+                for name, key in fields:
+                    value = results[key][q][i]
+                    if key == "metadatas":
+                        value = value or {}
+                        value = value if include_original_data else slim_metadata(value)
+                    elif key == "embeddings" and hasattr(value, "tolist"):
+                        value = value.tolist()
+                    result[name] = value
+                query_results.append(result)
+            formatted_results.append(query_results)
+
+        return formatted_results
+
+    def _search_flat(self, index: FlatVectorIndex, query_embeddings, k: int,
+                     where: Optional[Dict[str, Any]], include: Sequence[str],
+                     include_original_data: bool) -> List[List[Dict[str, Any]]]:
+        # Same result shape as the Chroma path; "score" is the cosine distance, as in Chroma
         formatted_results = []
-        if results["documents"]:
-            for i in range(len(results["documents"][0])):
-                formatted_results.append({
-                    "content": results["documents"][0][i],
-                    "metadata": results["metadatas"][0][i] if results["metadatas"] else {},
-                    "score": results["distances"][0][i] if results["distances"] else 0.0
-                })
-                
+        for hits in index.search(query_embeddings, k, where=where):
+            query_results = []
+            for row, similarity in hits:
+                result = {"id": index.ids[row]}
+                if "documents" in include:
+                    result["content"] = index.documents[row]
+                if "metadatas" in include:
+                    metadata = index.metadatas[row] or {}
+                    result["metadata"] = metadata if include_original_data else slim_metadata(metadata)
+                if "distances" in include:
+                    result["score"] = 1.0 - similarity
+                if "embeddings" in include:
+                    result["embedding"] = index.vector(row).tolist()
+                query_results.append(result)
+            formatted_results.append(query_results)
         return formatted_results
 
 # Singleton
@@ -0,0 +1,97 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# main.py imports this module before the rest of the app, so the gap to lifespan startup is import time
+PROCESS_STARTED = time.perf_counter()
+
+class StartupReport:
+    """
+    Readiness of this process plus a per-phase timing breakdown of its startup.
+    The process is live as soon as it serves requests, but only ready once warm-up has finished.
+    """
+    def __init__(self):
+        self.ready = False
+        self.error: Optional[str] = None
+        self.warnings: List[str] = []
+        self.phases: Dict[str, float] = {} # Phase name -> milliseconds, in completion order
+
+    def record(self, name: str, started: float):
+        self.phases[name] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Startup phase {name}: {self.phases[name]:.1f} ms")
+
+    @contextmanager
+    def phase(self, name: str, required: bool = True):
+        """
+        Times a startup phase. A failing optional phase is logged and does not block readiness.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if required:
+                raise
+            logger.warning(f"Startup phase {name} failed: {e}")
+            self.warnings.append(f"{name}: {e}")
+        finally:
+            self.record(name, started)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "warnings": list(self.warnings),
+            "phases_ms": dict(self.phases),
+            "total_ms": round(sum(self.phases.values()), 1)
+        }
+
+def warm_up(report: "StartupReport"):
+    """
+    Loads the configured models and runs one dummy inference through each, so the
+    first requests after a deploy do not pay for downloads, imports or lazy initialization.
+    Blocking; run it off the event loop.
+    """
+    # Imported here so they are timed as part of warm-up, not of module import
+    from app.services.embeddings import get_embedding_service
+    from app.services.vector_store import get_vector_db
+    from app.services.retrieval import get_retrieval_service
+    from app.services.safety import get_safety_guard, get_semantic_safety_classifier
+    from app.services.reranker import get_reranker
+    from app.services.generation import get_generation_service
+
+    try:
+        with report.phase("embedding_model"):
+            get_embedding_service().warm_up()
+        with report.phase("vector_store"):
+            get_vector_db().count()
+        with report.phase("lexical_index"):
+            get_retrieval_service().lexical_index()
+        with report.phase("safety"):
+            get_safety_guard()
+            get_semantic_safety_classifier()
+        with report.phase("reranker", required=False):
+            reranker = get_reranker()
+            if reranker is not None:
+                reranker.warm_up()
+        # Generation fails over between backends, so a cold or broken primary does not block traffic
+        with report.phase("generation", required=False):
+            get_generation_service().warm_up()
+    except Exception as e:
+        logger.error(f"Warm-up failed, staying not ready: {e}")
+        report.error = str(e)
+        return
+
+    report.ready = True
+    logger.info(f"Warm-up complete in {sum(report.phases.values()):.0f} ms")
+
+_startup_report = None
+def get_startup_report() -> StartupReport:
+    global _startup_report
+    if _startup_report is None:
+        _startup_report = StartupReport()
+    return _startup_report
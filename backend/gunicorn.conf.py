@@ -0,0 +1,32 @@
+# Multi-worker serving: gunicorn -c gunicorn.conf.py app.main:app
+import os
+from app.core.config import get_settings
+from app.core.metrics import clear_snapshots
+from app.core.serving import limit_threads, preload_for_fork, threads_per_worker
+
+settings = get_settings()
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = settings.SERVER_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+graceful_timeout = 30
+
+# Import the app once in the master; models are then loaded there by when_ready
+preload_app = settings.SERVER_PRELOAD_MODELS
+
+# Before the app (and torch/numpy) is imported, so the thread pools are created at this size
+limit_threads(threads_per_worker(workers))
+
+def on_starting(server):
+    # Snapshots left by a previous run would otherwise be added to this run's totals
+    if settings.METRICS_MULTIPROCESS_DIRECTORY:
+        clear_snapshots()
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before any worker is forked
+    if settings.SERVER_PRELOAD_MODELS:
+        preload_for_fork()
+
+def post_fork(server, worker):
+    limit_threads(threads_per_worker(workers))
@@ -4,8 +4,7 @@ import os
 # Add the current directory to sys.path so we can import app
 sys.path.append(os.getcwd())
 
-from app.services.vector_store import get_vector_db
-from app.services.ingestion import KnowledgeIngestion
+from app.services.indexing import KnowledgeIndexer
 
 def ingest():
     print("Starting ingestion...")
@@ -18,14 +17,12 @@ def ingest():
         print(f"Error: File not found at {file_path}")
         return
 
-    docs = KnowledgeIngestion.load_file(file_path)
-    print(f"Loaded {len(docs)} documents.")
-    
-    vector_db = get_vector_db()
-    # ChromaDB might complain if IDs are duplicates, but our ID generation uses hash of content, so it should be idempotent-ish.
-    # However, to be clean, we might want to reset, but for now appending is safer than deleting everything.
-    print("Adding to vector store...")
-    vector_db.add_documents(docs)
+    # IDs are content hashes and the manifest tracks the file's hash,
+    # so re-running only re-embeds when the knowledge base actually changed.
+    indexer = KnowledgeIndexer()
+    stats = indexer.sync([file_path])
+    if stats["unchanged"]:
+        print("Knowledge base unchanged, nothing to do.")
     print("Ingestion complete.")
 
 if __name__ == "__main__":
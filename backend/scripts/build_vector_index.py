@@ -0,0 +1,27 @@
+import sys
+import os
+import argparse
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import get_settings
+from app.services.flat_index import DTYPES, build_flat_index
+from app.services.vector_store import get_vector_db, bump_index_version
+
+settings = get_settings()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Snapshot the Chroma collection into the memory-mapped numpy index (VECTOR_BACKEND=numpy)."
+    )
+    parser.add_argument("--directory", default=settings.VECTOR_INDEX_DIRECTORY)
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default=settings.VECTOR_INDEX_DTYPE)
+    parser.add_argument("--nlist", type=int, default=settings.VECTOR_IVF_NLIST,
+                        help="k-means lists for IVF search (0 for exact flat search)")
+    args = parser.parse_args()
+
+    # Ingestion rebuilds the index automatically when VECTOR_BACKEND=numpy; this is for changing dtype/nlist
+    index = build_flat_index(get_vector_db(), args.directory, args.dtype, args.nlist)
+    bump_index_version()
+    print(f"Vector index built: {len(index)} chunks, {index.dtype}, {index.nlist} lists, in {index.directory}")
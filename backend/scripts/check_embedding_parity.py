@@ -0,0 +1,106 @@
+import sys
+import os
+import glob
+import time
+import argparse
+from itertools import islice
+
+import numpy as np
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import get_settings
+from app.services.chunking import get_chunker
+from app.services.ingestion import KnowledgeIngestion
+from app.services.embeddings import OnnxEmbeddingService
+
+settings = get_settings()
+
+SAMPLE_QUERIES = [
+    "What is yoga?",
+    "Which poses help with lower back pain?",
+    "How do I breathe during meditation?",
+    "Is yoga safe during pregnancy?",
+    "Benefits of sun salutation",
+    "How long should I hold a plank?",
+]
+
+def load_texts(data_dir: str, limit: int):
+    chunker = get_chunker()
+    texts = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "**/*.*"), recursive=True)):
+        try:
+            chunks = chunker.iter_documents(KnowledgeIngestion.iter_file(path))
+            texts.extend(chunk["content"] for chunk in islice(chunks, limit - len(texts)))
+            if len(texts) >= limit:
+                return texts
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    return texts
+
+def timed_encode(encode, texts, batch_size: int):
+    started = time.perf_counter()
+    vectors = np.concatenate([encode(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+    return vectors.astype(np.float32), time.perf_counter() - started
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+def check_parity(data_dir: str, limit: int, quantized: bool, top_k: int, min_cosine: float, batch_size: int) -> bool:
+    """
+    Embeds the same texts with the PyTorch model and the ONNX export and reports cosine drift,
+    top-k neighbour agreement for sample queries, and throughput of both.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    texts = load_texts(data_dir, limit)
+    if not texts:
+        print(f"No documents found in {data_dir}; using sample queries only.")
+    queries = SAMPLE_QUERIES
+    print(f"Comparing {len(texts)} chunks and {len(queries)} queries ({'int8' if quantized else 'fp32'} ONNX)...")
+
+    torch_model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME, device="cpu")
+    onnx_service = OnnxEmbeddingService(quantized=quantized)
+    torch_encode = lambda batch: torch_model.encode(batch, batch_size=batch_size)
+    # Warm both up so one-off initialization does not skew the timings
+    torch_encode(queries)
+    onnx_service.encode(queries)
+
+    all_texts = texts + queries
+    torch_vectors, torch_seconds = timed_encode(torch_encode, all_texts, batch_size)
+    onnx_vectors, onnx_seconds = timed_encode(onnx_service.encode, all_texts, batch_size)
+
+    cosines = np.sum(normalize(torch_vectors) * normalize(onnx_vectors), axis=1)
+    print(f"\nCosine similarity (PyTorch vs ONNX) over {len(all_texts)} texts:")
+    print(f"  mean {cosines.mean():.5f}   p1 {np.percentile(cosines, 1):.5f}   min {cosines.min():.5f}")
+
+    if texts:
+        k = min(top_k, len(texts))
+        torch_docs, onnx_docs = torch_vectors[:len(texts)], onnx_vectors[:len(texts)]
+        overlaps = []
+        for torch_query, onnx_query in zip(torch_vectors[len(texts):], onnx_vectors[len(texts):]):
+            torch_top = set(np.argsort(-(torch_docs @ torch_query))[:k])
+            onnx_top = set(np.argsort(-(onnx_docs @ onnx_query))[:k])
+            overlaps.append(len(torch_top & onnx_top) / k)
+        print(f"Top-{k} neighbour agreement for sample queries: {np.mean(overlaps):.3f}")
+
+    print(f"\nThroughput: PyTorch {len(all_texts) / torch_seconds:.1f} texts/s, "
+          f"ONNX {len(all_texts) / onnx_seconds:.1f} texts/s ({torch_seconds / onnx_seconds:.2f}x)")
+
+    ok = bool(cosines.min() >= min_cosine)
+    print("✅ Parity check passed" if ok else f"❌ Minimum cosine below {min_cosine}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report embedding drift between the PyTorch model and its ONNX export.")
+    parser.add_argument("data_dir", nargs="?", default="data/knowledge_base")
+    parser.add_argument("--limit", type=int, default=500, help="Chunks to compare")
+    parser.add_argument("--fp32", action="store_true", help="Check the unquantized ONNX model")
+    parser.add_argument("--top-k", type=int, default=settings.TOP_K_RETRIEVAL)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    ok = check_parity(args.data_dir, args.limit, not args.fp32, args.top_k, args.min_cosine, args.batch_size)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,99 @@
+import sys
+import os
+import json
+import argparse
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import get_settings
+from app.services.embeddings import ONNX_MODEL_FILE, ONNX_QUANTIZED_MODEL_FILE, ONNX_TOKENIZER_FILE, ONNX_CONFIG_FILE
+
+settings = get_settings()
+
+def export_onnx(output_dir: str, model_name: str = settings.EMBEDDING_MODEL_NAME, quantize: bool = True, opset: int = 14):
+    """
+    Exports the transformer of a sentence-transformers model to ONNX, plus its fast tokenizer
+    and the pooling/normalization settings OnnxEmbeddingService needs to reproduce its vectors.
+    Requires torch, sentence-transformers and onnxruntime (only where the export runs).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    print(f"Loading {model_name}...")
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    auto_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    pooling = "mean"
+    normalize = False
+    for module in st_model:
+        if hasattr(module, "pooling_mode_cls_token") and module.pooling_mode_cls_token:
+            pooling = "cls"
+        if type(module).__name__ == "Normalize":
+            normalize = True
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = tokenizer(["What is yoga?", "Breathing exercises for beginners"], padding=True, return_tensors="pt")
+    input_names = list(sample.keys())
+
+    class Encoder(torch.nn.Module):
+        # Positional inputs for the exporter; returns the token embeddings only (pooling runs in numpy)
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    print(f"Exporting to {model_path}...")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            Encoder(auto_model),
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_path = os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE)
+        print(f"Quantizing weights to int8: {quantized_path}...")
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+
+    # The fast tokenizer carries its own truncation/padding rules; match SentenceTransformer's
+    backend_tokenizer = tokenizer.backend_tokenizer
+    backend_tokenizer.enable_truncation(st_model.max_seq_length)
+    backend_tokenizer.enable_padding(pad_id=tokenizer.pad_token_id, pad_token=tokenizer.pad_token)
+    backend_tokenizer.save(os.path.join(output_dir, ONNX_TOKENIZER_FILE))
+
+    config = {
+        "model_name": model_name,
+        "pooling": pooling,
+        "normalize": normalize,
+        "max_seq_length": st_model.max_seq_length,
+        "pad_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token
+    }
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    print(f"Export complete: pooling={pooling}, normalize={normalize}, max_seq_length={st_model.max_seq_length}")
+    print("Set EMBEDDING_BACKEND=onnx to serve it, and run scripts/check_embedding_parity.py first.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX for CPU inference without torch.")
+    parser.add_argument("output_dir", nargs="?", default=settings.EMBEDDING_ONNX_DIRECTORY)
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 model")
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+
+    export_onnx(args.output_dir, args.model, quantize=not args.no_quantize, opset=args.opset)
@@ -0,0 +1,45 @@
+import sys
+import os
+import asyncio
+import argparse
+import logging
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import get_settings
+from app.services.embeddings import create_embedding_service
+from app.services.llm_backends import TransformersBackend
+from app.services.sidecar import InferenceSidecar
+
+settings = get_settings()
+
+def sidecar_generation_configured() -> bool:
+    return "sidecar" in (name.strip() for name in settings.GENERATION_BACKENDS.split(","))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve local embedding (and optionally generation) models to every API worker over a Unix socket."
+    )
+    parser.add_argument("--socket", default=settings.INFERENCE_SOCKET_PATH)
+    parser.add_argument("--embedding-backend", choices=["torch", "onnx"], default=settings.SIDECAR_EMBEDDING_BACKEND)
+    parser.add_argument(
+        "--generation",
+        action=argparse.BooleanOptionalAction,
+        default=sidecar_generation_configured(),
+        help="Also load and serve the local generation model (default: only when GENERATION_BACKENDS lists sidecar)"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    print(f"Loading {args.embedding_backend} embedding model...")
+    embedding_service = create_embedding_service(args.embedding_backend)
+    embedding_service.warm_up()
+    generation_backend = None
+    if args.generation:
+        print(f"Loading generation model {settings.LOCAL_MODEL_NAME}...")
+        generation_backend = TransformersBackend()
+        generation_backend.warm_up()
+
+    print(f"Inference sidecar listening on {args.socket}")
+    asyncio.run(InferenceSidecar(embedding_service, generation_backend).serve(args.socket))
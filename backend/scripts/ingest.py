@@ -1,55 +1,52 @@
 import sys
 import os
 import glob
+import argparse
 
 # Add parent directory to path so we can import app
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.services.ingestion import KnowledgeIngestion
-from app.services.chunking import TextChunker
-from app.services.vector_store import get_vector_db
+from app.core.config import get_settings
+from app.services.chunking import get_chunker
+from app.services.indexing import KnowledgeIndexer
 
-def ingest_data(data_dir: str):
+settings = get_settings()
+
+SUPPORTED_EXTENSIONS = ('.json', '.jsonl', '.ndjson', '.txt', '.pdf', '.md')
+
+def ingest_data(data_dir: str,
+                workers: int = settings.INGEST_WORKERS,
+                embed_batch_size: int = settings.INGEST_EMBED_BATCH_SIZE,
+                write_batch_size: int = settings.INGEST_WRITE_BATCH_SIZE):
     print(f"Scanning {data_dir} for documents...")
     files = glob.glob(os.path.join(data_dir, "**/*.*"), recursive=True)
+    files = [f for f in files if f.lower().endswith(SUPPORTED_EXTENSIONS)]
     
     if not files:
         print("No files found.")
-        return
 
-    vector_db = get_vector_db()
-    chunker = TextChunker()
-    
-    total_chunks = 0
-    
-    for file_path in files:
-        if not file_path.lower().endswith(('.json', '.txt', '.pdf', '.md')):
-            continue
-            
-        print(f"Processing {file_path}...")
-        try:
-            # 1. Load
-            docs = KnowledgeIngestion.load_file(file_path)
-            
-            # 2. Chunk
-            chunked_docs = chunker.split_documents(docs)
-            
-            # 3. Store
-            if chunked_docs:
-                vector_db.add_documents(chunked_docs)
-                total_chunks += len(chunked_docs)
-                print(f"  -> Added {len(chunked_docs)} chunks.")
-            else:
-                print("  -> No content extracted.")
-                
-        except Exception as e:
-            print(f"  -> Error: {e}")
-
-    print(f"\nIngestion Complete! Total chunks stored: {total_chunks}")
+    # Only new or changed files are re-chunked and re-embedded;
+    # chunks of files deleted from data_dir are removed.
+    indexer = KnowledgeIndexer(
+        chunker=get_chunker(),
+        embed_batch_size=embed_batch_size,
+        write_batch_size=write_batch_size
+    )
+    stats = indexer.sync(files, root=data_dir, workers=workers)
+
+    print(
+        f"\nIngestion Complete! {stats['added']} added, {stats['updated']} updated, "
+        f"{stats['unchanged']} unchanged, {stats['removed']} removed, {stats['failed']} failed. "
+        f"Chunks written: {stats['chunks']}"
+    )
 
 if __name__ == "__main__":
-    data_directory = "data/knowledge_base"
-    if len(sys.argv) > 1:
-        data_directory = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Ingest a knowledge base directory into the vector store.")
+    parser.add_argument("data_dir", nargs="?", default="data/knowledge_base")
+    parser.add_argument("--workers", type=int, default=settings.INGEST_WORKERS,
+                        help="Parser processes (1 parses in-process)")
+    parser.add_argument("--embed-batch-size", type=int, default=settings.INGEST_EMBED_BATCH_SIZE)
+    parser.add_argument("--write-batch-size", type=int, default=settings.INGEST_WRITE_BATCH_SIZE)
+    args = parser.parse_args()
     
-    ingest_data(data_directory)
+    ingest_data(args.data_dir, args.workers, args.embed_batch_size, args.write_batch_size)